@@ -0,0 +1,139 @@
+"""Listening-habit analytics of a play store: heatmaps, streaks, skips and platforms"""
+import numpy as np
+import pandas as pd
+
+# Weekday names of the heatmap rows, reason_end values that count as a
+# skip whatever the skipped field says, and how many streaks to list
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+SKIP_END_REASONS = ['fwdbtn']
+ANALYTICS_TOP_STREAKS = 10
+# Views in the result of compute_analytics
+ANALYTICS_VIEWS = ['heatmap', 'streaks', 'skips', 'platforms']
+# Device families by lowercase prefix of the platform field, first match wins
+PLATFORM_FAMILIES = [
+    ('android', 'Android'),
+    ('ios', 'iOS'),
+    ('iphone', 'iOS'),
+    ('ipad', 'iOS'),
+    ('windows', 'Windows'),
+    ('os x', 'macOS'),
+    ('osx', 'macOS'),
+    ('macos', 'macOS'),
+    ('web_player', 'Web Player'),
+    ('web', 'Web Player'),
+    ('linux', 'Linux'),
+    ('cast', 'Cast'),
+    ('partner', 'Partner'),
+]
+
+def local_play_times(ts, tz):
+    """Local weekday (Monday is 0), hour and day number (days since 1970-01-01) of epoch seconds"""
+    if tz == 'UTC':
+        days, seconds = np.divmod(ts, 86400)
+        hours = seconds // 3600
+    else:
+        local = pd.to_datetime(ts, unit='s', utc=True).tz_convert(tz).tz_localize(None)
+        local_seconds = local.to_numpy().astype('datetime64[s]').astype(np.int64)
+        days, seconds = np.divmod(local_seconds, 86400)
+        hours = seconds // 3600
+    # 1970-01-01 was a Thursday
+    weekdays = (days + 3) % 7
+    return weekdays, hours, days
+
+def platform_families(platforms):
+    """Map the device strings of an export's platform column to a few families, by prefix"""
+    # Categories of an export without any platform values come out empty and untyped
+    categories = platforms.cat.categories.astype(str).str.lower()
+    families = np.full(len(categories), 'Other', dtype=object)
+    for prefix, family in reversed(PLATFORM_FAMILIES):
+        families[categories.str.startswith(prefix)] = family
+    families = np.append(families, 'Unknown')
+    # Missing platforms have code -1, which picks the Unknown family appended last
+    return families[platforms.cat.codes.to_numpy()]
+
+def daily_streaks(days):
+    """Runs of consecutive days with plays as (first day, length), longest first"""
+    active = np.unique(days)
+    if not len(active):
+        return active, np.array([], dtype=np.int64)
+    # A new run starts wherever the previous active day was not yesterday
+    starts = np.flatnonzero(np.diff(active, prepend=active[0] - 2) != 1)
+    lengths = np.diff(starts, append=len(active))
+    order = np.lexsort((-active[starts], -lengths))
+    return active[starts][order], lengths[order]
+
+def compute_analytics(play_frame, tz='UTC'):
+    """Compute the listening-habit analytics of a play store in one pass over its columns
+
+    A play counts as skipped when the export says so or when it ended with the forward button.
+    """
+    ts = play_frame['ts'].to_numpy()
+    ms_played = play_frame['ms_played'].to_numpy().astype(np.int64)
+    skips = (play_frame['skipped'].to_numpy() == 1) | play_frame['reason_end'].isin(SKIP_END_REASONS).to_numpy()
+    shuffle = play_frame['shuffle'].to_numpy()
+
+    # Heatmap and streaks: plays with a timestamp, in local time
+    # Plays without a timestamp hold NaT
+    timed = ~np.isnat(ts.view('datetime64[s]'))
+    weekdays, hours, days = local_play_times(ts[timed], tz)
+    cells = weekdays * 24 + hours
+    heat_plays = np.bincount(cells, minlength=7 * 24).reshape(7, 24)
+    heat_minutes = (np.bincount(cells, weights=ms_played[timed], minlength=7 * 24) / 60000).round(1).reshape(7, 24)
+    heatmap = {
+        'weekdays': WEEKDAYS,
+        'hours': list(range(24)),
+        'plays': heat_plays.tolist(),
+        'minutes': heat_minutes.tolist(),
+    }
+
+    streak_starts, streak_lengths = daily_streaks(days)
+    def streak(run):
+        start, length = int(streak_starts[run]), int(streak_lengths[run])
+        return {'days': length, 'start': str(np.datetime64(start, 'D')), 'end': str(np.datetime64(start + length - 1, 'D'))}
+    has_streaks = len(streak_starts) > 0
+    streaks = {
+        'active_days': int(streak_lengths.sum()),
+        'longest': streak(0) if has_streaks else None,
+        # The streak running up to the last day of the history
+        'latest': streak(int(np.argmax(streak_starts))) if has_streaks else None,
+        'top': [streak(run) for run in range(min(len(streak_starts), ANALYTICS_TOP_STREAKS))],
+    }
+
+    # Skips per song, counted like the song table (plays with track and artist)
+    is_song = (play_frame['track'].notna() & play_frame['artist'].notna()).to_numpy()
+    song_skips = pd.DataFrame({
+        'track': play_frame['track'][is_song],
+        'artist': play_frame['artist'][is_song],
+        'skips': skips[is_song],
+    }).groupby(['track', 'artist'], observed=True, sort=False).agg(
+        Plays=pd.NamedAgg(column='skips', aggfunc='size'),
+        Skips=pd.NamedAgg(column='skips', aggfunc='sum'),
+    ).reset_index().rename(columns={'track': 'Song', 'artist': 'Artist'})
+    song_skips['Skips'] = song_skips['Skips'].astype(np.int64)
+    song_skips['Skip Rate'] = (song_skips['Skips'] / song_skips['Plays']).round(3)
+    song_skips = song_skips.sort_values(['Skip Rate', 'Plays'], ascending=False, kind='stable').reset_index(drop=True)
+
+    # Platform families, with rates over the plays where the export has the field
+    families, family_codes = np.unique(platform_families(play_frame['platform']), return_inverse=True)
+    def per_family(values):
+        return np.bincount(family_codes, weights=values, minlength=len(families))
+    known_shuffle = shuffle >= 0
+    platforms = pd.DataFrame({
+        'Platform': families,
+        'Plays': np.bincount(family_codes, minlength=len(families)),
+        'Minutes Played': (per_family(ms_played) / 60000).round(1),
+        'Skip Rate': (per_family(skips) / np.maximum(np.bincount(family_codes, minlength=len(families)), 1)).round(3),
+        'Shuffle Rate': (per_family(shuffle == 1) / np.maximum(per_family(known_shuffle), 1)).round(3),
+    }).sort_values('Plays', ascending=False, kind='stable').reset_index(drop=True)
+
+    return {
+        'heatmap': heatmap,
+        'streaks': streaks,
+        'skips': {
+            'plays': int(len(skips)),
+            'skipped': int(skips.sum()),
+            'rate': round(float(skips.mean()), 3) if len(skips) else None,
+            'songs': song_skips,
+        },
+        'platforms': platforms,
+    }
@@ -1,27 +1,173 @@
 import os
+import io
+import gzip
 import json
+import time
+import re
+import pstats
+import shutil
+import cProfile
+import hashlib
+import secrets
 import zipfile
-from flask import Flask, request, jsonify
-from werkzeug.utils import secure_filename
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import wraps
+from itertools import repeat
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import brotli
+from flask import Flask, request, jsonify, g
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
 from flask_cors import CORS
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from analytics import ANALYTICS_VIEWS, compute_analytics
+from chunked import ChunkedAggregator
+from metrics import (
+    MetricsPublisher, collect_metrics, instrumented, prometheus_histogram, prometheus_labels,
+    record_stage, request_metrics, reset_stage_metrics, stage_metrics, timed_stage,
+)
+from playstore import (
+    CATEGORICAL_PLAY_COLUMNS, NUMERIC_PLAY_COLUMNS, aggregate_months, aggregate_song_months, aggregate_songs,
+    build_play_frame, combine_song_months, concat_play_frames, empty_play_frame, fold_positions, grow, key_index,
+    rollup_song_table, song_table,
+)
+from search import SEARCH_RESULT_LIMIT, SEARCH_TYPES, SearchIndex
+from upload_receipt import UploadRequest, allowed_file
 
 app = Flask(__name__, static_folder='static', static_url_path='/')
 CORS(app)  # Enable CORS for frontend requests
 
 UPLOAD_FOLDER = 'uploads'
-EXTRACT_FOLDER = 'extracted'
-ALLOWED_EXTENSIONS = {'zip'}
+CACHE_FOLDER = 'cache'
+JSON_READ_CHUNK_SIZE = 1 << 16
+# Columns the search bar matches against at each aggregation level
+SEARCH_COLUMNS = {
+    'song': ['Song', 'Artist', 'Album'],
+    'album': ['Album', 'Artist'],
+    'artist': ['Artist'],
+}
+# Most results /api/search returns for one query
+SEARCH_MAX_LIMIT = 100
+# Time-range tables kept per dataset
+RANGE_VIEW_CACHE_SIZE = 8
+TABLE_FORMATS = ['records', 'columns']
+# Song table column that album and artist detail views group on
+DETAIL_COLUMNS = {'album': 'Album', 'artist': 'Artist'}
+HASH_CHUNK_SIZE = 1 << 20
+# JSON responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+# Content codings in order of preference, with the levels used for responses built
+# per request and for the precompressed bodies of the default table views
+CONTENT_ENCODINGS = ['br', 'gzip']
+LIVE_COMPRESSION_LEVELS = {'br': 4, 'gzip': 6}
+CACHED_COMPRESSION_LEVELS = {'br': 9, 'gzip': 9}
+# Query arguments a default table view may carry, and the precompressed bodies kept
+# per dataset: one per level, format and content coding
+DEFAULT_VIEW_ARGS = ['column', 'direction', 'format', 'session']
+RESPONSE_CACHE_SIZE = 12
+# Analytics kept per dataset, for the time zones last asked for
+ANALYTICS_CACHE_SIZE = 4
+# Songs listed by /api/analytics/skips unless limit says otherwise, and the plays
+# a song needs before its skip rate is listed
+SKIP_TABLE_LIMIT = 100
+SKIP_TABLE_MIN_PLAYS = 5
+# Lines of the cProfile report returned for a profiled request
+PROFILE_REPORT_LINES = 60
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['EXTRACT_FOLDER'] = EXTRACT_FOLDER
+app.config['CACHE_FOLDER'] = CACHE_FOLDER
+# Processes used to parse the files of an export in parallel (1 parses in-process)
+app.config['PARSE_WORKERS'] = int(os.environ.get('PARSE_WORKERS', 1))
+# Memory ceiling for aggregating one upload; when set, exports are aggregated in
+# chunks spilled to disk (see chunked.py) instead of all in memory
+app.config['AGGREGATION_MAX_BYTES'] = int(os.environ.get('AGGREGATION_MAX_BYTES', 0))
+if app.config['AGGREGATION_MAX_BYTES']:
+    # Arrow's default allocator keeps the memory it frees mapped, where it would count
+    # against the ceiling; the system allocator hands it back
+    pa.set_memory_pool(pa.system_memory_pool())
+# Limits on uploads: the request body (larger ones are refused with 413), and the
+# number of entries in the ZIP, their total uncompressed size and how many times
+# its compressed size any one entry may inflate to
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('UPLOAD_MAX_BYTES', 1024 ** 3))
+app.config['UPLOAD_MAX_ENTRIES'] = int(os.environ.get('UPLOAD_MAX_ENTRIES', 1000))
+app.config['UPLOAD_MAX_UNCOMPRESSED_BYTES'] = int(os.environ.get('UPLOAD_MAX_UNCOMPRESSED_BYTES', 16 * 1024 ** 3))
+app.config['UPLOAD_MAX_COMPRESSION_RATIO'] = int(os.environ.get('UPLOAD_MAX_COMPRESSION_RATIO', 100))
+# Uploads processed concurrently in the background
+app.config['UPLOAD_JOB_WORKERS'] = int(os.environ.get('UPLOAD_JOB_WORKERS', 2))
+# Bounds on the parsed datasets each process keeps in memory, and on how long
+# sessions live without being used
+app.config['SESSION_MAX_BYTES'] = int(os.environ.get('SESSION_MAX_BYTES', 2 * 1024 ** 3))
+app.config['SESSION_TTL_SECONDS'] = int(os.environ.get('SESSION_TTL_SECONDS', 2 * 60 * 60))
+# Cached datasets unused for this long are deleted; never sooner than sessions expire
+app.config['CACHE_TTL_SECONDS'] = int(os.environ.get('CACHE_TTL_SECONDS', 7 * 24 * 60 * 60))
+# Lets a request pass profile=1 to get a cProfile report instead of its response
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
 
+SESSION_HEADER = 'X-Session-Token'
+# Sessions in use have their file's modification time refreshed at most this often
+SESSION_TOUCH_SECONDS = 60
+# Running upload jobs write their progress for other processes at most this often
+JOB_STATE_INTERVAL_SECONDS = 0.5
 # Ensure folders exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(EXTRACT_FOLDER, exist_ok=True)
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+def parse_zip_member(file_path, member_name):
+    """Decode one file of an export into a play store; runs in a worker process
+
+    The worker's stage metrics for the file are returned too, for the parent to merge.
+    """
+    play_frame = build_play_frame(iter_plays_from_zip(file_path, [member_name]))
+    return play_frame, stage_metrics.drain()
+
+@instrumented('cache_write')
+def write_cache(cache_path, frames, files=None):
+    """Write the Feather files of a cache entry, moving in the already written `files`
+
+    Goes through a temporary directory, so a half-written cache is never picked up.
+    """
+    temp_path = f"{cache_path}.tmp-{secrets.token_hex(4)}"
+    os.makedirs(temp_path)
+    try:
+        for name, df in frames.items():
+            # Uncompressed so the files can be memory-mapped back in
+            feather.write_feather(
+                df.reset_index(drop=True), os.path.join(temp_path, f"{name}.feather"),
+                compression='uncompressed'
+            )
+        for name, path in (files or {}).items():
+            shutil.move(path, os.path.join(temp_path, f"{name}.feather"))
+        os.rename(temp_path, cache_path)
+    except OSError:
+        # Another request finished caching the same upload first
+        shutil.rmtree(temp_path, ignore_errors=True)
+        if not os.path.isdir(cache_path):
+            raise
+
+def read_cached_table(cache_path, name):
+    """Read a Feather file of a cache entry, memory-mapped"""
+    table = feather.read_table(os.path.join(cache_path, f"{name}.feather"), memory_map=True)
+    # One block per column lets numeric columns stay views of the mapped file,
+    # whose pages every worker process shares
+    return table.to_pandas(split_blocks=True)
 
 class DataParser:
     def __init__(self, data=None):
+        # Raw plays are held in a columnar DataFrame; per-file lists of play dicts
+        # (the layout of the export itself) are converted on the way in
+        if isinstance(data, dict):
+            data = build_play_frame(
+                (file_name, play) for file_name, file_data in data.items() for play in file_data
+            )
+        # Cache entry the parser was loaded from, whose play store and month tables
+        # are only read in when first used
+        self.cache_path = None
         self.data = data
         # Each instance has its own processed data
         # This prevents caching issues between different uploads
@@ -29,13 +175,58 @@ class DataParser:
         # Cache for aggregated data
         self.album_data = None
         self.artist_data = None
-        # Cache for sorted data
-        self.song_data_sorted = {}
-        self.album_data_sorted = {}
-        self.artist_data_sorted = {}
+        self.monthly_data = None
+        # Exact totals behind the rounded minutes of the song, album and artist tables
+        # (milliseconds for songs, hundredths of a minute for albums and artists)
+        self.song_ms_played = None
+        self.album_minutes = None
+        self.artist_minutes = None
+        # Song plays and milliseconds per (month, song row), sorted by month
+        self.song_months = None
+        # Parsers holding the tables of recently requested time ranges, keyed by
+        # (first month, month after the last)
+        self.range_views = OrderedDict()
+        # Cache for sorted data: the ascending row permutation of each sorted column,
+        # keyed by (level, column)
+        self.sort_indexes = {}
+        # Song rows and summary of every album and artist, keyed by detail type
+        self.detail_indexes = {}
+        # Identifies this exact dataset in response ETags; parsers built from an
+        # export take its content hash, merged parsers get a fresh one
+        self.version = secrets.token_hex(16)
+        # Compressed bodies of the default table views, keyed by (endpoint, level, format, coding)
+        self.response_cache = OrderedDict()
+        # Deep size of the tables above, which only change by being replaced, as
+        # (ids of the tables, bytes)
+        self._table_bytes = None
+        # Listening-habit analytics of the last few time zones asked for
+        self.analytics = OrderedDict()
+        # SearchIndex over the song, album and artist names
+        self.search_index = None
+        # Guards the bounded caches above, which requests on other threads evict from
+        self.cache_lock = threading.Lock()
+
+    @property
+    def data(self):
+        """The columnar play store, read from the cache entry on first use"""
+        if self._data is None and self.cache_path is not None:
+            self._data = read_cached_table(self.cache_path, 'plays')
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def has_plays(self):
+        """Whether there is a play store, without reading it in"""
+        return self._data is not None or self.cache_path is not None
 
     def parse(self):
-        """Parse the raw Spotify data and return song-level DataFrame"""
+        """Parse the raw Spotify data and return song-level DataFrame
+
+        The album and artist tables are rolled up from the song table's codes in the
+        same pass, so all three levels come from one numbering of the songs.
+        """
         # If this instance already has processed data, return it
         if self.processed_data is not None:
             return self.processed_data
@@ -44,54 +235,20 @@ class DataParser:
         if self.data is None:
             return pd.DataFrame()  # Return empty DataFrame
             
-        dfs = []
-        # Implement your data parsing logic here
-        for (key, value) in self.data.items():
-            print(f"key: {key}, value size: {len(value)}")
-
-            # Convert to Pandas DataFrame
-            df = pd.DataFrame(value)
-
-            # Aggregate by track name and artist name at this step
-            grouped_df = df.groupby(['master_metadata_track_name', 'master_metadata_album_artist_name']).agg(
-                total_ms_played=pd.NamedAgg(column='ms_played', aggfunc='sum'),
-                play_count=pd.NamedAgg(column='spotify_track_uri', aggfunc='count'),
-                track_name=pd.NamedAgg(column='master_metadata_track_name', aggfunc='first'),
-                artist_name=pd.NamedAgg(column='master_metadata_album_artist_name', aggfunc='first'),
-                album_name=pd.NamedAgg(column='master_metadata_album_album_name', aggfunc='first')
-            ).reset_index()
-            dfs.append(grouped_df)
-
-        # Combine all DataFrames into one
-        if not dfs:
-            return pd.DataFrame()  # Return empty DataFrame
-            
-        combined_df = pd.concat(dfs, ignore_index=True)
-        print(f"Columns in combined_df before groupby: {combined_df.columns}")
-
-        # Perform final grouping by track_name and artist_name to properly aggregate different URIs
-        final_grouped_df = combined_df.groupby(
-            ['track_name', 'artist_name']
-        ).agg(
-            total_ms_played=pd.NamedAgg(column='total_ms_played', aggfunc='sum'),
-            play_count=pd.NamedAgg(column='play_count', aggfunc='sum'),
-            album_name=pd.NamedAgg(column='album_name', aggfunc='first'),
-        ).reset_index()
-
-        # Convert milliseconds to minutes and round to nearest hundredths place
-        final_grouped_df['Minutes Played'] = (final_grouped_df['total_ms_played'] / 60000).round(2)
-        final_grouped_df.drop(columns=['total_ms_played'], inplace=True)
-        final_grouped_df.rename(columns={
-            "play_count": "Plays",
-            "artist_name": "Artist",
-            "album_name": "Album",
-            "track_name": "Song"
-        }, inplace=True)
-        
+        app.logger.debug(f"Parsing {len(self.data)} plays from {self.data['file'].nunique()} files")
+        song_df, self.song_ms_played = song_table(aggregate_songs(self.data))
+        if not song_df.empty:
+            self.rollup(song_df)
+
         # Store the processed data in this instance
-        self.processed_data = final_grouped_df
-        
-        return final_grouped_df
+        self.processed_data = song_df
+
+        return song_df
+
+    def rollup(self, song_df):
+        """Fill in the album and artist tables from a song table"""
+        (self.album_data, self.album_minutes,
+         self.artist_data, self.artist_minutes) = rollup_song_table(song_df)
     
     def get_album_aggregation(self, song_df=None):
         """Aggregate data to album level"""
@@ -105,24 +262,9 @@ class DataParser:
         if song_df.empty:
             return pd.DataFrame()
         
-        # Group by Album and Artist
-        album_df = song_df.groupby(['Album', 'Artist']).agg(
-            Plays=pd.NamedAgg(column='Plays', aggfunc='sum'),
-            Minutes_Played=pd.NamedAgg(column='Minutes Played', aggfunc='sum'),
-            Songs=pd.NamedAgg(column='Song', aggfunc='count')
-        ).reset_index()
-        
-        # Round minutes to 1 decimal place
-        album_df['Minutes Played'] = album_df['Minutes_Played'].round(1)
-        album_df.drop(columns=['Minutes_Played'], inplace=True)
-        
-        # Sort by plays descending
-        album_df = album_df.sort_values('Plays', ascending=False)
-        
-        # Cache the result
-        self.album_data = album_df
-        
-        return album_df
+        # Cached along with the artist table, exact minutes kept aside for incremental appends
+        self.rollup(song_df)
+        return self.album_data
     
     def get_artist_aggregation(self, song_df=None):
         """Aggregate data to artist level"""
@@ -136,85 +278,472 @@ class DataParser:
         if song_df.empty:
             return pd.DataFrame()
         
-        # First, create album aggregation to count albums per artist
-        album_count = song_df.groupby('Artist')['Album'].nunique().reset_index()
-        album_count.columns = ['Artist', 'Albums']
-        
-        # Now aggregate other metrics
-        artist_df = song_df.groupby(['Artist']).agg(
-            Plays=pd.NamedAgg(column='Plays', aggfunc='sum'),
-            Minutes_Played=pd.NamedAgg(column='Minutes Played', aggfunc='sum'),
-            Songs=pd.NamedAgg(column='Song', aggfunc='count')
-        ).reset_index()
-        
-        # Merge with album count
-        artist_df = artist_df.merge(album_count, on='Artist')
-        
-        # Round minutes to 1 decimal place
-        artist_df['Minutes Played'] = artist_df['Minutes_Played'].round(1)
-        artist_df.drop(columns=['Minutes_Played'], inplace=True)
-        
-        # Sort by plays descending
-        artist_df = artist_df.sort_values('Plays', ascending=False)
-        
-        # Cache the result
-        self.artist_data = artist_df
-        
-        return artist_df
+        # Cached along with the album table, exact minutes kept aside for incremental appends
+        self.rollup(song_df)
+        return self.artist_data
 
-    def get_sorted_data(self, data_type, sort_column, direction="desc"):
-        """Get pre-sorted data for faster client-side rendering"""
+    def memory_usage(self):
+        """Estimate the bytes held by this parser's raw plays, aggregates and caches"""
+        tables = [self._data, self.processed_data, self.album_data, self.artist_data, self.monthly_data, self.song_months]
+        # Measuring string columns deeply is slow, so table sizes are only measured once
+        table_ids = tuple(id(df) for df in tables)
+        if self._table_bytes is None or self._table_bytes[0] != table_ids:
+            size = sum(int(df.memory_usage(index=True, deep=True).sum()) for df in tables if df is not None)
+            self._table_bytes = (table_ids, size)
+        total = self._table_bytes[1]
 
-        # Get the appropriate data set
-        if data_type == 'song':
-            df = self.processed_data
-            cache = self.song_data_sorted
-        elif data_type == 'album':
-            if self.album_data is None:
-                self.get_album_aggregation()
-            df = self.album_data
-            cache = self.album_data_sorted
-        elif data_type == 'artist':
-            if self.artist_data is None:
-                self.get_artist_aggregation()
-            df = self.artist_data
-            cache = self.artist_data_sorted
-        else:
-            return []
-            
+        total += sum(permutation.nbytes for permutation, _ in self.sort_indexes.values())
+        total += sum(positions.nbytes + 100 * len(groups) for positions, groups in self.detail_indexes.values())
+        with self.cache_lock:
+            bodies, views, analytics = (list(self.response_cache.values()), list(self.range_views.values()),
+                                        list(self.analytics.values()))
+        total += sum(len(body) for body in bodies)
+        total += sum(view.memory_usage() for view in views)
+        total += sum(
+            int(result['skips']['songs'].memory_usage(deep=True).sum()) + int(result['platforms'].memory_usage(deep=True).sum())
+            for result in analytics
+        )
+        if self.search_index is not None:
+            total += self.search_index.nbytes
+        return total
+
+    @classmethod
+    def from_zip(cls, file_path, workers=1, progress=None):
+        """Create a parser for an export ZIP, optionally parsing its files in parallel
+
+        Args:
+            file_path: Path of the export ZIP
+            workers: Number of processes to parse files with
+            progress: Optional UploadJob to report parsed files and rows to
+        """
+        member_names = list_streaming_history_members(file_path)
+        if progress is not None:
+            progress.start_phase('parsing', files_total=len(member_names))
+        if workers <= 1 or len(member_names) <= 1:
+            return cls(load_play_frame_from_zip(file_path, progress))
+
+        frames = []
+        with ProcessPoolExecutor(max_workers=min(workers, len(member_names)), initializer=reset_stage_metrics) as pool:
+            for frame, worker_metrics in pool.map(parse_zip_member, repeat(file_path), member_names):
+                stage_metrics.merge(worker_metrics)
+                frames.append(frame)
+                if progress is not None:
+                    progress.advance(files=1, rows=len(frame))
+
+        return cls(concat_play_frames(frames))
+
+    def find_existing_plays(self, plays):
+        """Mark which of the given plays this parser already holds, matched on (ts, track_uri)"""
+        uris = self.data['track_uri'].cat.categories.union(plays['track_uri'].cat.categories)
+
+        def play_keys(play_frame):
+            uri_codes = pd.Categorical(play_frame['track_uri'], categories=uris).codes
+            return pd.MultiIndex.from_arrays([play_frame['ts'].to_numpy(), uri_codes])
+
+        return play_keys(plays).isin(play_keys(self.data))
+
+    @instrumented('append')
+    def append(self, new_plays):
+        """Create a parser with new plays folded into this one's data and aggregates
+
+        Plays already present (same ts and track URI) are dropped; only the rest is aggregated.
+        """
+        delta = new_plays[~self.find_existing_plays(new_plays)]
+        app.logger.info(f"Appending {len(delta)} of {len(new_plays)} plays")
+        if delta.empty:
+            return self
+
+        merged = DataParser(concat_play_frames([self.data, delta]))
+        song_df = self.parse()
+        if song_df.empty:
+            return merged
+        album_df = self.get_album_aggregation()
+        artist_df = self.get_artist_aggregation()
+
+        # Songs: add the delta's plays and milliseconds, appending songs never played before
+        delta_songs = aggregate_songs(delta)
+        positions, is_new = fold_positions(
+            key_index(song_df, ['Song', 'Artist']), key_index(delta_songs, ['track', 'artist'])
+        )
+        changed_old = positions[~is_new]
+        new_count = int(is_new.sum())
+
+        plays = grow(song_df['Plays'].to_numpy(), new_count)
+        plays[positions] += delta_songs['play_count'].to_numpy()
+        ms_played = grow(self.song_ms_played, new_count)
+        ms_played[positions] += delta_songs['total_ms_played'].to_numpy()
+        albums = grow(song_df['Album'].to_numpy(dtype=object), new_count, None)
+        # A song keeps the album it was first seen with, unless it had none
+        delta_albums = delta_songs['album_name'].to_numpy(dtype=object)
+        missing_album = pd.isna(albums[positions])
+        albums[positions[missing_album]] = delta_albums[missing_album]
+
+        combined = merged.data
+        song_names = np.concatenate([song_df['Song'].to_numpy(dtype=object), delta_songs['track'].to_numpy(dtype=object)[is_new]])
+        artist_names = np.concatenate([song_df['Artist'].to_numpy(dtype=object), delta_songs['artist'].to_numpy(dtype=object)[is_new]])
+        minutes = (ms_played / 60000).round(2)
+        merged.processed_data = pd.DataFrame({
+            'Song': pd.Categorical(song_names, categories=combined['track'].cat.categories),
+            'Artist': pd.Categorical(artist_names, categories=combined['artist'].cat.categories),
+            'Plays': plays,
+            'Album': pd.Categorical(albums, categories=combined['album'].cat.categories),
+            'Minutes Played': minutes,
+        })
+        merged.song_ms_played = ms_played
+
+        # Each changed song adds its new totals to its album and artist and takes back
+        # the totals it contributed before the append
+        old_minutes = np.rint(song_df['Minutes Played'].to_numpy() * 100).astype(np.int64)
+        contributions = pd.DataFrame({
+            'Album': np.concatenate([albums[positions], song_df['Album'].to_numpy(dtype=object)[changed_old]]),
+            'Artist': np.concatenate([artist_names[positions], artist_names[changed_old]]),
+            'Plays': np.concatenate([plays[positions], -song_df['Plays'].to_numpy()[changed_old]]),
+            'Minutes': np.concatenate([np.rint(minutes[positions] * 100).astype(np.int64), -old_minutes[changed_old]]),
+            'Songs': np.concatenate([np.ones(len(positions), dtype=np.int64), -np.ones(len(changed_old), dtype=np.int64)]),
+        })
+
+        # Albums
+        album_delta = contributions.dropna(subset=['Album']).groupby(['Album', 'Artist'], sort=False).sum().reset_index()
+        album_positions, new_albums = fold_positions(key_index(album_df, ['Album', 'Artist']), key_index(album_delta, ['Album', 'Artist']))
+        album_count = int(new_albums.sum())
+        album_totals = pd.DataFrame({
+            'Album': np.concatenate([album_df['Album'].to_numpy(dtype=object), album_delta['Album'].to_numpy(dtype=object)[new_albums]]),
+            'Artist': np.concatenate([album_df['Artist'].to_numpy(dtype=object), album_delta['Artist'].to_numpy(dtype=object)[new_albums]]),
+            'Plays': grow(album_df['Plays'].to_numpy(), album_count),
+            'Songs': grow(album_df['Songs'].to_numpy(), album_count),
+            'Minutes_Played': grow(self.album_minutes, album_count),
+        })
+        for column, delta_column in [('Plays', 'Plays'), ('Songs', 'Songs'), ('Minutes_Played', 'Minutes')]:
+            album_totals.loc[album_positions, column] += album_delta[delta_column].to_numpy()
+        album_totals = album_totals[album_totals['Songs'] > 0]
+        album_totals['Minutes Played'] = (album_totals['Minutes_Played'] / 100).round(1)
+        album_totals = album_totals.sort_values('Plays', ascending=False)
+        merged.album_minutes = album_totals.pop('Minutes_Played').to_numpy()
+        album_totals['Album'] = pd.Categorical(album_totals['Album'], categories=combined['album'].cat.categories)
+        album_totals['Artist'] = pd.Categorical(album_totals['Artist'], categories=combined['artist'].cat.categories)
+        merged.album_data = album_totals
+
+        # Artists, whose album count moves with the albums that appeared or emptied out
+        old_album_counts = pd.Series(1, index=album_df['Artist'].to_numpy(dtype=object)).groupby(level=0).sum()
+        new_album_counts = pd.Series(1, index=album_totals['Artist'].to_numpy(dtype=object)).groupby(level=0).sum()
+        artist_delta = contributions.groupby('Artist', sort=False)[['Plays', 'Minutes', 'Songs']].sum().reset_index()
+        artist_positions, new_artists = fold_positions(key_index(artist_df, ['Artist']), key_index(artist_delta, ['Artist']))
+        artist_count = int(new_artists.sum())
+        artist_totals = pd.DataFrame({
+            'Artist': np.concatenate([artist_df['Artist'].to_numpy(dtype=object), artist_delta['Artist'].to_numpy(dtype=object)[new_artists]]),
+            'Plays': grow(artist_df['Plays'].to_numpy(), artist_count),
+            'Songs': grow(artist_df['Songs'].to_numpy(), artist_count),
+            'Albums': grow(artist_df['Albums'].to_numpy(), artist_count),
+            'Minutes_Played': grow(self.artist_minutes, artist_count),
+        })
+        for column, delta_column in [('Plays', 'Plays'), ('Songs', 'Songs'), ('Minutes_Played', 'Minutes')]:
+            artist_totals.loc[artist_positions, column] += artist_delta[delta_column].to_numpy()
+        touched_artists = artist_delta['Artist'].to_numpy(dtype=object)
+        artist_totals.loc[artist_positions, 'Albums'] += (
+            new_album_counts.reindex(touched_artists, fill_value=0).to_numpy()
+            - old_album_counts.reindex(touched_artists, fill_value=0).to_numpy()
+        )
+        artist_totals['Minutes Played'] = (artist_totals['Minutes_Played'] / 100).round(1)
+        artist_totals = artist_totals.sort_values('Plays', ascending=False)
+        merged.artist_minutes = artist_totals.pop('Minutes_Played').to_numpy()
+        artist_totals['Artist'] = pd.Categorical(artist_totals['Artist'], categories=combined['artist'].cat.categories)
+        merged.artist_data = artist_totals
+
+        # Months: add the delta's (month, song) rows, keeping first-played order for ties
+        monthly_df = self.get_monthly_aggregation()
+        delta_months = aggregate_months(delta)
+        month_keys = ['month', 'track', 'artist']
+        month_positions, new_months = fold_positions(key_index(monthly_df, month_keys), key_index(delta_months, month_keys))
+        monthly_totals = pd.concat([monthly_df, delta_months[new_months]], ignore_index=True)
+        matched = ~new_months
+        for column in ['plays', 'ms_played']:
+            monthly_totals.loc[month_positions[matched], column] += delta_months[column].to_numpy()[matched]
+        monthly_totals['track'] = pd.Categorical(monthly_totals['track'].astype(object), categories=combined['track'].cat.categories)
+        merged.monthly_data = monthly_totals
+
+        # Song months: song rows keep their positions, so the delta's partials just add in
+        merged.song_months = combine_song_months([
+            self.get_song_months(),
+            aggregate_song_months(delta, key_index(merged.processed_data, ['Song', 'Artist'])),
+        ])
+
+        return merged
+
+    def to_cache(self, cache_path):
+        """Persist the play store and every aggregate as Feather files under cache_path (see write_cache)"""
+        write_cache(cache_path, {
+            'plays': self.data,
+            **self.aggregate_frames(),
+        })
+
+    def aggregate_frames(self):
+        """The aggregates kept in the cache, with their exact totals as extra columns"""
+        return {
+            **self.table_frames(),
+            'monthly': self.get_monthly_aggregation(),
+            'song_months': self.get_song_months(),
+        }
+
+    def table_frames(self):
+        """The song, album and artist tables as cached, with their exact totals as extra columns"""
+        return {
+            'song': self.parse().assign(_ms_played=self.song_ms_played),
+            'album': self.get_album_aggregation().assign(_minutes=self.album_minutes),
+            'artist': self.get_artist_aggregation().assign(_minutes=self.artist_minutes),
+        }
+
+    @classmethod
+    def from_zip_chunked(cls, file_path, cache_path, max_bytes, progress=None, base_parser=None):
+        """Aggregate an export ZIP within a memory ceiling into cache_path, as from_zip would
+
+        With a base_parser, appends as append does, returning base_parser if no plays are new.
+        """
+        if progress is not None:
+            progress.start_phase('parsing', files_total=len(list_streaming_history_members(file_path)))
+        spill_path = f"{cache_path}.spill-{secrets.token_hex(4)}"
+        try:
+            aggregator = ChunkedAggregator(spill_path, max_bytes)
+            if base_parser is not None:
+                base_plays = os.path.join(app.config['CACHE_FOLDER'], base_parser.version, 'plays.feather')
+                if os.path.exists(base_plays):
+                    aggregator.add_plays_file(base_plays)
+                else:
+                    aggregator.add_frame(base_parser.data)
+                aggregator.start_new_plays()
+            plays = iter_plays_from_zip(file_path)
+            if progress is not None:
+                plays = track_progress(plays, progress)
+            for file_name, play in plays:
+                aggregator.add(file_name, play)
+
+            if progress is not None:
+                progress.start_phase('aggregating')
+            result = aggregator.finish()
+            if base_parser is not None:
+                app.logger.info(f"Appending {aggregator.new_plays} of {aggregator.offered_plays} plays")
+                if not aggregator.new_plays:
+                    return base_parser
+            if result is None:
+                return cls(empty_play_frame())
+            paths, songs = result
+
+            parser = cls()
+            parser.processed_data, parser.song_ms_played = song_table(songs)
+            if parser.processed_data.empty:
+                # Nothing worth caching, as with from_zip
+                return cls(feather.read_feather(paths['plays']))
+            parser.rollup(parser.processed_data)
+
+            if progress is not None:
+                progress.start_phase('caching')
+            write_cache(cache_path, parser.table_frames(), files=paths)
+            parser.cache_path = cache_path
+        finally:
+            shutil.rmtree(spill_path, ignore_errors=True)
+        return parser
+
+    @classmethod
+    @instrumented('cache_read')
+    def from_cache(cls, cache_path):
+        """Create a parser for a cache written by to_cache, with the song, album and artist
+        tables loaded and the rest read on first use"""
+        columns = feather.read_table(os.path.join(cache_path, 'plays.feather'), memory_map=True).column_names
+        missing = [column for column in [*CATEGORICAL_PLAY_COLUMNS, *NUMERIC_PLAY_COLUMNS] if column not in columns]
+        if missing:
+            # Written before these columns were kept; load_dataset rebuilds the entry
+            raise KeyError(f"Cached plays lack {', '.join(missing)}")
+        parser = cls()
+        parser.cache_path = cache_path
+        parser.processed_data = read_cached_table(cache_path, 'song')
+        parser.song_ms_played = parser.processed_data.pop('_ms_played').to_numpy()
+        parser.album_data = read_cached_table(cache_path, 'album')
+        parser.album_minutes = parser.album_data.pop('_minutes').to_numpy()
+        parser.artist_data = read_cached_table(cache_path, 'artist')
+        parser.artist_minutes = parser.artist_data.pop('_minutes').to_numpy()
+        return parser
+
+    def get_sorted_data(self, data_type, sort_column, direction="desc", offset=0, limit=None):
+        """Get sorted data for faster client-side rendering
+
+        Only the order is cached (see get_sort_index); records are built just for
+        the rows between offset and offset + limit.
+        """
+        df = self.get_table(data_type)
         if df is None or df.empty:
             return []
-            
-        # Check if we already have this sort cached
-        cache_key = f"{sort_column}_{direction}"
-        if cache_key in cache:
-            return cache[cache_key]
-            
-        # Sort the data
+
         try:
-            ascending = direction.lower() != "desc"
-            
-            # Make sure the column exists in the dataframe
-            if sort_column not in df.columns:
-                # Try to find a close match (case-insensitive)
-                possible_columns = [col for col in df.columns if col.lower() == sort_column.lower()]
-                if possible_columns:
-                    sort_column = possible_columns[0]
-                else:
-                    # Default to "Plays" if column doesn't exist
-                    sort_column = "Plays"
-                    
-            sorted_df = df.sort_values(by=sort_column, ascending=ascending)
-            sorted_data = sorted_df.to_dict(orient="records")
-            
-            # Cache the result
-            cache[cache_key] = sorted_data
-            return sorted_data
+            page_df, _ = self.get_page(data_type, sort_column, direction, offset=offset, limit=limit)
+            return page_df.to_dict(orient="records")
         except Exception as e:
-            print(f"Error during sorting: {e}")
+            app.logger.warning(f"Error during sorting: {e}")
             # Fallback if sorting fails
             return df.to_dict(orient="records")
+
+    def get_table(self, data_type):
+        """Return the aggregated table for an aggregation level, or None if the level is unknown"""
+        if data_type == 'song':
+            return self.parse()
+        elif data_type == 'album':
+            return self.get_album_aggregation()
+        elif data_type == 'artist':
+            return self.get_artist_aggregation()
+        return None
+
+    def get_sort_permutation(self, data_type, sort_column):
+        """Get the ascending row order of one column of a table, computed once per column
+
+        Returns the permutation (rows with missing values placed last) and the number
+        of rows that have a value.
+        """
+        df = self.get_table(data_type)
+
+        # Make sure the column exists in the dataframe
+        if sort_column not in df.columns:
+            # Try to find a close match (case-insensitive)
+            possible_columns = [col for col in df.columns if col.lower() == sort_column.lower()]
+            if possible_columns:
+                sort_column = possible_columns[0]
+            else:
+                # Default to "Plays" if column doesn't exist
+                sort_column = "Plays"
+        if sort_column not in df.columns:
+            # Exports without music plays leave the tables without any columns
+            return np.empty(0, dtype=np.int32), 0
+
+        cache_key = (data_type, sort_column)
+        if cache_key in self.sort_indexes:
+            return self.sort_indexes[cache_key]
+
+        with timed_stage('sort'):
+            values = df[sort_column]
+            if isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories.is_monotonic_increasing:
+                # Category codes follow the order of the names, so sort the small integers instead
+                keys = values.cat.codes.to_numpy()
+                missing = keys < 0
+            else:
+                keys = values.to_numpy()
+                missing = values.isna().to_numpy()
+
+            present = np.flatnonzero(~missing)
+            order = present[np.argsort(keys[present], kind='stable')]
+            permutation = np.concatenate([order, np.flatnonzero(missing)])
+            if len(permutation) < np.iinfo(np.int32).max:
+                permutation = permutation.astype(np.int32)
+
+        self.sort_indexes[cache_key] = (permutation, len(present))
+        return permutation, len(present)
+
+    def get_sort_index(self, data_type, sort_column, direction="desc"):
+        """Get the row positions of a table in sorted order
+
+        Descending order reads the ascending permutation backwards (keeping rows
+        with missing values last) rather than caching a second array.
+        """
+        permutation, present = self.get_sort_permutation(data_type, sort_column)
+        if direction.lower() != "desc":
+            return permutation
+        if present == len(permutation):
+            return permutation[::-1]
+        return np.concatenate([permutation[present - 1::-1] if present else permutation[:0], permutation[present:]])
+
+    def get_search_mask(self, data_type, query):
+        """Mark the rows where any searchable column contains the query, ignoring case"""
+        df = self.get_table(data_type)
+        term = query.lower().strip()
+        mask = np.zeros(len(df), dtype=bool)
+
+        for column in SEARCH_COLUMNS[data_type]:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Match each distinct name once, then spread the result through the codes
+                # (the extra False entry is picked up by the -1 code of missing values)
+                matches = values.cat.categories.str.lower().str.contains(term, regex=False)
+                mask |= np.append(np.asarray(matches, dtype=bool), False)[values.cat.codes.to_numpy()]
+            else:
+                mask |= values.str.lower().str.contains(term, regex=False, na=False).to_numpy(dtype=bool)
+        return mask
+
+    def get_detail_index(self, detail_type):
+        """Group the song table by album or artist once, with each group's summary precomputed
+
+        Returns (positions, groups), groups mapping a name to (start, end, plays, minutes) of positions.
+        """
+        if detail_type in self.detail_indexes:
+            return self.detail_indexes[detail_type]
+
+        with timed_stage('detail_index'):
+            song_df = self.parse()
+            order = song_df['Plays'].reset_index(drop=True).sort_values(ascending=False).index.to_numpy()
+            codes, names = pd.factorize(song_df[DETAIL_COLUMNS[detail_type]].to_numpy()[order])
+
+            # A stable sort on the group codes keeps the plays ordering within each group
+            known = codes >= 0
+            group_order = np.argsort(codes[known], kind='stable')
+            positions = order[known][group_order]
+            group_codes = codes[known][group_order]
+
+            starts = np.searchsorted(group_codes, np.arange(len(names)))
+            ends = np.append(starts[1:], len(positions))
+            groups = {}
+            if len(positions):
+                plays = np.add.reduceat(song_df['Plays'].to_numpy()[positions], starts)
+                minutes = np.add.reduceat(song_df['Minutes Played'].to_numpy()[positions], starts)
+                for name, start, end, total_plays, total_minutes in zip(names, starts, ends, plays, minutes):
+                    groups[name] = (int(start), int(end), int(total_plays), float(total_minutes))
+
+        self.detail_indexes[detail_type] = (positions, groups)
+        return positions, groups
+
+    def get_detail(self, detail_type, detail_name):
+        """Get the songs of one album or artist, by plays descending, and their summary"""
+        positions, groups = self.get_detail_index(detail_type)
+        start, end, total_plays, total_minutes = groups.get(detail_name, (0, 0, 0, 0.0))
+        summary = {
+            'total_plays': total_plays,
+            'total_minutes': total_minutes,
+            'song_count': end - start
+        }
+        return self.parse().iloc[positions[start:end]], summary
+
+    def get_page(self, data_type, sort_column=None, direction="desc", offset=0, limit=None, columns=None, query=None):
+        """Get one page of a table, along with the number of rows matching the query
+
+        Args:
+            data_type: Aggregation level ('song', 'album' or 'artist')
+            sort_column: Column to sort by, or None to keep the table's own order
+            direction: 'asc' or 'desc'
+            offset: Number of matching rows to skip
+            limit: Maximum number of rows to return, or None for all of them
+            columns: Columns to include in each record, or None for all of them
+            query: Text the search columns of a row must contain
+        """
+        df = self.get_table(data_type)
+        if df is None:
+            raise ValueError('Invalid aggregation level')
+        if columns:
+            unknown_columns = [column for column in columns if column not in df.columns]
+            if unknown_columns:
+                raise ValueError(f"Unknown columns: {', '.join(unknown_columns)}")
+        if df.empty:
+            return df, 0
+
+        if sort_column:
+            positions = self.get_sort_index(data_type, sort_column, direction)
+        else:
+            positions = np.arange(len(df))
+
+        if query and query.strip():
+            positions = positions[self.get_search_mask(data_type, query)[positions]]
+
+        total = len(positions)
+        end = None if limit is None else offset + limit
+        page_df = df.iloc[positions[offset:end]]
+        if columns:
+            page_df = page_df[columns]
+        return page_df, total
         
+    @instrumented('monthly_top_songs')
     def get_monthly_top_songs(self, top_count=5):
         """Get the top songs for each month based on play count within that month
         
@@ -230,7 +759,7 @@ class DataParser:
         
         # TODO: this is super weird. just use demo data
         # Demo data or data without timestamps - generate synthetic months
-        if not self.data or not isinstance(self.data, dict):
+        if not self.has_plays():
             # Create synthetic monthly data
             song_df = self.processed_data.copy()
             months = ['2023-10', '2023-11', '2023-12', '2024-01', '2024-02', '2024-03']
@@ -271,112 +800,655 @@ class DataParser:
             monthly_top_songs.sort(reverse=True, key=lambda x: x['month'])
             return monthly_top_songs
         
-        # With real data, we need to calculate monthly stats
-        # Create a data structure to hold monthly plays for each song
-        monthly_songs = {}  # format: {month: {song_key: {'plays': X, 'minutes': Y, song data...}}}
-        
-        for file_name, file_data in self.data.items():
-            for play in file_data:
-                # Skip entries without necessary data
-                if not all(key in play for key in ['ts', 'master_metadata_track_name', 'ms_played']):
-                    continue
-
-                # Skip podcast episodes - check if episode fields have values
-                if play.get('episode_name') or play.get('episode_show_name') or play.get('spotify_episode_uri'):
-                    continue
-                    
-                # Extract month from timestamp (format YYYY-MM-DD...)
-                if isinstance(play['ts'], str) and len(play['ts']) >= 7:
-                    month = play['ts'][:7]  # Get YYYY-MM
-                    
-                    # Create song key for identification
-                    song_key = (
-                        play['master_metadata_track_name'],
-                        play.get('master_metadata_album_artist_name', ''),
-                    )
-                    
-                    # Get album name
-                    album_name = play.get('master_metadata_album_album_name', '')
-                    
-                    # Initialize month data if needed
-                    if month not in monthly_songs:
-                        monthly_songs[month] = {}
-                    
-                    # Initialize song data if needed
-                    if song_key not in monthly_songs[month]:
-                        monthly_songs[month][song_key] = {
-                            'song': song_key[0],
-                            'artist': song_key[1],
-                            'album': album_name,
-                            'plays': 0,
-                            'minutes_played': 0
-                        }
-                    
-                    # Update counts
-                    monthly_songs[month][song_key]['plays'] += 1
-                    # Convert ms to minutes
-                    monthly_songs[month][song_key]['minutes_played'] += play['ms_played'] / 60000
-        
-        # Find top songs for each month
-        monthly_top_songs = []
-        
-        for month, songs in monthly_songs.items():
-            if not songs:  # Skip months with no data
-                continue
-                
-            # Get all songs in this month
-            month_song_list = list(songs.values())
-            
-            # Sort by plays in descending order
-            month_song_list.sort(key=lambda s: s['minutes_played'], reverse=True)
-            
-            # Take the top N songs
-            top_month_songs = month_song_list[:top_count]
-            
-            # Add rank to each song
-            for i, song in enumerate(top_month_songs):
-                song['rank'] = i + 1
-                song['minutes_played'] = round(song['minutes_played'], 1)
-            
-            monthly_top_songs.append({
-                'month': month,
-                'songs': top_month_songs
+        monthly_df = self.get_monthly_aggregation()
+        if monthly_df.empty:
+            return []
+
+        # Partial top-k per month: only the N largest rows of each month are selected,
+        # ties keep the order in which the songs were first played that month
+        top_index = monthly_df.groupby('month', sort=False)['ms_played'].nlargest(top_count).index
+        top_df = monthly_df.loc[top_index.get_level_values(-1)]
+        top_df = top_df.assign(
+            month_name=top_df['month'].to_numpy().astype('datetime64[M]').astype(str),
+            rank=top_df.groupby('month', sort=False).cumcount() + 1,
+            minutes_played=(top_df['ms_played'] / 60000).round(1),
+        )
+
+        monthly_top_songs = {}
+        for month, song, artist, album, plays, minutes_played, rank in zip(
+            top_df['month_name'], top_df['track'], top_df['artist'], top_df['album'],
+            top_df['plays'], top_df['minutes_played'], top_df['rank']
+        ):
+            monthly_top_songs.setdefault(month, []).append({
+                'song': song,
+                'artist': artist,
+                'album': album,
+                'plays': int(plays),
+                'minutes_played': float(minutes_played),
+                'rank': int(rank)
             })
-        
+
         # Sort by month (most recent first)
-        monthly_top_songs.sort(reverse=True, key=lambda x: x['month'])
-        return monthly_top_songs
+        return [
+            {'month': month, 'songs': monthly_top_songs[month]}
+            for month in sorted(monthly_top_songs, reverse=True)
+        ]
+
+    def get_monthly_aggregation(self):
+        """Aggregate plays to one row per (month, song) with a single groupby"""
+        # Return cached data if available
+        if self.monthly_data is not None:
+            return self.monthly_data
+
+        if self.cache_path is not None:
+            monthly_df = read_cached_table(self.cache_path, 'monthly')
+        else:
+            monthly_df = aggregate_months(self.data)
+
+        # Cache the result
+        self.monthly_data = monthly_df
+
+        return monthly_df
+
+    def get_song_months(self):
+        """Get the (month, song) partial totals that time-range tables are summed from"""
+        if self.song_months is None and self.cache_path is not None:
+            self.song_months = read_cached_table(self.cache_path, 'song_months')
+        elif self.song_months is None:
+            self.song_months = aggregate_song_months(self.data, key_index(self.parse(), ['Song', 'Artist']))
+        return self.song_months
+
+    def get_search_index(self):
+        """Get the name search index of this dataset, building it on first use"""
+        if self.search_index is None:
+            with timed_stage('search_index'):
+                song_df = self.parse()
+                self.search_index = SearchIndex(
+                    song_df, self.get_album_aggregation(song_df), self.get_artist_aggregation(song_df)
+                )
+        return self.search_index
+
+    def get_cached(self, cache, key):
+        """Look up an entry of one of the bounded caches, marking it as the most recently used"""
+        with self.cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def put_cached(self, cache, key, value, max_entries):
+        """Add an entry to one of the bounded caches, evicting the least recently used beyond max_entries"""
+        with self.cache_lock:
+            cache[key] = value
+            while len(cache) > max_entries:
+                cache.popitem(last=False)
+
+    def get_analytics(self, tz='UTC'):
+        """Get the listening-habit analytics of this dataset in a time zone (see compute_analytics)"""
+        result = self.get_cached(self.analytics, tz)
+        if result is not None:
+            return result
 
-def load_json_data_from_zip(filename, file_path):
+        with timed_stage('analytics'):
+            result = compute_analytics(self.data, tz)
+        self.put_cached(self.analytics, tz, result, ANALYTICS_CACHE_SIZE)
+        return result
+
+    def get_range_view(self, start_month, end_month):
+        """Get a parser holding the song, album and artist tables of a range of months
+
+        Months are offsets from 1970-01, end_month exclusive; the last few ranges are kept.
+        """
+        key = (start_month, end_month)
+        view = self.get_cached(self.range_views, key)
+        if view is not None:
+            return view
+
+        with timed_stage('range_view'):
+            song_df = self.parse()
+            view = DataParser()
+            if song_df.empty:
+                view.processed_data = song_df
+            else:
+                cube = self.get_song_months()
+                first, last = np.searchsorted(cube['month'].to_numpy(), [start_month, end_month])
+                rows = cube.iloc[first:last]
+                songs = rows['song'].to_numpy()
+                played = np.bincount(songs, minlength=len(song_df)) > 0
+                plays = np.zeros(len(song_df), dtype=np.int64)
+                np.add.at(plays, songs, rows['plays'].to_numpy())
+                ms_played = np.zeros(len(song_df), dtype=np.int64)
+                np.add.at(ms_played, songs, rows['ms_played'].to_numpy())
+
+                view.song_ms_played = ms_played[played]
+                view.processed_data = song_df[played].assign(
+                    Plays=plays[played],
+                    **{'Minutes Played': (view.song_ms_played / 60000).round(2)}
+                ).reset_index(drop=True)
+            view.get_album_aggregation()
+            view.get_artist_aggregation()
+
+        self.put_cached(self.range_views, key, view, RANGE_VIEW_CACHE_SIZE)
+        return view
+
+def iter_json_array(stream):
+    """Yield the elements of a top-level JSON array one at a time from a text stream
+
+    Time spent reading the stream (for a ZIP member, inflating it) and decoding JSON
+    is recorded as the zip_read and json_decode stages once the array is done.
+    """
+    decoder = json.JSONDecoder()
+    read_seconds = 0.0
+    decode_seconds = 0.0
+
+    def read():
+        nonlocal read_seconds
+        read_start = time.perf_counter()
+        chunk = stream.read(JSON_READ_CHUNK_SIZE)
+        read_seconds += time.perf_counter() - read_start
+        return chunk
+
+    try:
+        buffer = read()
+        while buffer.isspace():
+            buffer = read()
+        buffer = buffer.lstrip()
+        if not buffer.startswith('['):
+            raise ValueError('Expected a JSON array')
+        position = 1
+        eof = False
+
+        while True:
+            # Skip whitespace and separators, reading more input when the buffer runs out
+            while True:
+                while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                buffer = read()
+                position = 0
+                eof = not buffer
+
+            if position >= len(buffer):
+                raise ValueError('Unterminated JSON array')
+            if buffer[position] == ']':
+                return
+
+            decode_start = time.perf_counter()
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                decode_seconds += time.perf_counter() - decode_start
+            except json.JSONDecodeError:
+                decode_seconds += time.perf_counter() - decode_start
+                if eof:
+                    raise
+                item, end = None, len(buffer)
+
+            # The element may continue past the end of the buffer, so read more and retry
+            if end >= len(buffer) and not eof:
+                chunk = read()
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            yield item
+            position = end
+    finally:
+        record_stage('zip_read', read_seconds)
+        record_stage('json_decode', decode_seconds)
+
+def is_streaming_history_file(member_name):
+    """Check whether a ZIP member is one of the Streaming_History_*.json files of an export"""
+    base_name = os.path.basename(member_name)
+    return base_name.startswith('Streaming_History') and base_name.endswith('.json')
+
+def list_streaming_history_members(file_path):
+    """Names of the Streaming_History_*.json members of an export ZIP"""
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        return [
+            member.filename for member in zip_ref.infolist()
+            if not member.is_dir() and is_streaming_history_file(member.filename)
+        ]
 
-    # Extract the ZIP file
-    extract_path = os.path.join(app.config['EXTRACT_FOLDER'], filename.replace('.zip', ''))
-    os.makedirs(extract_path, exist_ok=True)
+def iter_plays_from_zip(file_path, member_names=None):
+    """Stream (file_name, play) tuples out of a Spotify export ZIP without extracting it
 
+    Only the members listed in member_names are read, if given.
+    """
     with zipfile.ZipFile(file_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_path)
-
-    # Load JSON files
-    json_data = {}
-    for root, _, files in os.walk(extract_path):
-        for file in files:
-            print(f"Loading in: {file}")
-            if file.endswith('.json'):
-                json_path = os.path.join(root, file)
+        for member in zip_ref.infolist():
+            if member.is_dir() or not is_streaming_history_file(member.filename):
+                continue
+            if member_names is not None and member.filename not in member_names:
+                continue
+
+            file_name = os.path.basename(member.filename)
+            app.logger.debug(f"Loading in: {file_name}")
+            with zip_ref.open(member) as raw_stream:
+                stream = io.TextIOWrapper(raw_stream, encoding='utf-8-sig')
                 try:
-                    with open(json_path, 'r', encoding='utf-8') as f:  # Safe loading with UTF-8
-                        print("Adding data!")
-                        json_data[file] = json.load(f)
-                except json.JSONDecodeError:
-                    print("error error error\n\n")
-                    return jsonify({'message': f'Error reading {file}, invalid JSON format'}), 400
-    return json_data
+                    for play in iter_json_array(stream):
+                        yield file_name, play
+                except (ValueError, UnicodeDecodeError) as e:
+                    raise ValueError(f'Error reading {file_name}, invalid JSON format') from e
+
+def load_play_frame_from_zip(file_path, progress=None):
+    """Load every play in the export into the columnar play store"""
+    plays = iter_plays_from_zip(file_path)
+    if progress is not None:
+        plays = track_progress(plays, progress)
+    return build_play_frame(plays)
+
+def track_progress(plays, progress):
+    """Pass (file_name, play) records through, counting files and rows on an UploadJob"""
+    current_file = None
+    for file_name, play in plays:
+        if file_name != current_file:
+            if current_file is not None:
+                progress.advance(files=1)
+            current_file = file_name
+        progress.advance(rows=1)
+        yield file_name, play
+    if current_file is not None:
+        progress.advance(files=1)
+
+@instrumented('hash')
+def hash_file(file_path):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_dataset(file_path, progress=None, digest=None):
+    """Get a fully aggregated DataParser for an export ZIP, cached under the hash of its contents
+
+    Pass the hash as digest when it is already known, as it is for uploads.
+    """
+    if digest is None:
+        digest = hash_file(file_path)
+    cache_path = os.path.join(app.config['CACHE_FOLDER'], digest)
+    if os.path.isdir(cache_path):
+        try:
+            data_parser = DataParser.from_cache(cache_path)
+            data_parser.version = digest
+            touch_dataset(digest)
+            return data_parser
+        except (OSError, KeyError, pa.ArrowException) as e:
+            app.logger.warning(f"Ignoring unreadable cache {cache_path}: {e}")
+            shutil.rmtree(cache_path, ignore_errors=True)
+
+    if app.config['AGGREGATION_MAX_BYTES']:
+        data_parser = DataParser.from_zip_chunked(file_path, cache_path, app.config['AGGREGATION_MAX_BYTES'], progress)
+        data_parser.version = digest
+        return data_parser
+
+    data_parser = DataParser.from_zip(file_path, workers=app.config['PARSE_WORKERS'], progress=progress)
+    data_parser.version = digest
+    if progress is not None:
+        progress.start_phase('aggregating')
+    if not data_parser.parse().empty:
+        if progress is not None:
+            progress.start_phase('caching')
+        data_parser.to_cache(cache_path)
+    return data_parser
+
+def store_dataset(data_parser):
+    """Make sure a parser's dataset is in the Feather cache under its version
+
+    The cache is the store shared by all worker processes: any of them can load a
+    session's dataset from it. Returns whether the dataset is stored.
+    """
+    cache_path = os.path.join(app.config['CACHE_FOLDER'], data_parser.version)
+    if os.path.isdir(cache_path):
+        touch_dataset(data_parser.version)
+        return True
+    if data_parser.parse().empty:
+        return False
+    data_parser.to_cache(cache_path)
+    return True
+
+def touch_dataset(version):
+    """Mark a cached dataset as used, so prune_cache keeps it"""
+    try:
+        os.utime(os.path.join(app.config['CACHE_FOLDER'], version))
+    except OSError:
+        pass
+
+def prune_cache(max_age):
+    """Delete cached datasets, and leftovers of interrupted writes, not used for max_age seconds"""
+    now = time.time()
+    try:
+        entries = list(os.scandir(app.config['CACHE_FOLDER']))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name in ('sessions', 'jobs', 'metrics'):
+            continue
+        try:
+            if entry.is_dir() and now - entry.stat().st_mtime > max_age:
+                app.logger.info(f"Deleting unused cache entry {entry.name[:12]}...")
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            pass
+
+def start_session(data_parser):
+    """Pre-sort a parser's tables for the common case and register it under a new session"""
+    data_parser.get_sort_permutation('song', 'Plays')
+    data_parser.get_sort_permutation('album', 'Plays')
+    data_parser.get_sort_permutation('artist', 'Plays')
+    return parser_registry.add(data_parser, stored=store_dataset(data_parser))
+
+def state_path(kind, name):
+    """Path of a session or job state file shared between worker processes, or None
+    if the name could not have been generated by secrets.token_urlsafe"""
+    if not name or not name.replace('-', '').replace('_', '').isalnum():
+        return None
+    return os.path.join(app.config['CACHE_FOLDER'], kind, name)
+
+def write_state(kind, name, state):
+    """Atomically write a small JSON state file under the cache folder"""
+    path = state_path(kind, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp-{secrets.token_hex(4)}"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+def read_state(kind, name):
+    path = state_path(kind, name)
+    if path is None:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def prune_state(kind, max_age):
+    """Delete state files that have not been touched for max_age seconds"""
+    folder = os.path.join(app.config['CACHE_FOLDER'], kind)
+    now = time.time()
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+def save_metrics_state(name, state):
+    try:
+        write_state('metrics', name, state)
+    except OSError as e:
+        app.logger.warning(f"Cannot publish metrics: {e}")
+
+def process_gauges():
+    """Gauges of this process for /api/metrics, added up across the running workers"""
+    with upload_jobs_lock:
+        running_jobs = sum(1 for job in upload_jobs.values() if job.phase not in ('done', 'failed'))
+    return {
+        'sessions': len(parser_registry),
+        'session_memory_bytes': parser_registry.memory_usage(),
+        'upload_jobs_running': running_jobs,
+    }
+
+metrics_publisher = MetricsPublisher(save_metrics_state, process_gauges)
+
+class ParserRegistry:
+    """Session-keyed DataParser instances, shared between worker processes through the Feather cache
+
+    Each process keeps recently used ones within `max_bytes`; sessions expire after `ttl_seconds` idle.
+    """
+    def __init__(self, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # token -> [parser, last access time, estimated size in bytes, last time the
+        # session file was touched]
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, parser, stored=True):
+        """Register a parser and return the token of its new session
+
+        Parsers whose dataset is not in the cache (empty ones) are only served by
+        this process.
+        """
+        token = secrets.token_urlsafe(16)
+        now = time.time()
+        if stored:
+            write_state('sessions', token, {'dataset': parser.version})
+            prune_state('sessions', self.ttl_seconds)
+        size = parser.memory_usage()
+        with self._lock:
+            self._sessions[token] = [parser, now, size, now]
+            self._evict()
+        return token
+
+    def get(self, token):
+        """Return the parser of a session, or None if it is unknown or has expired"""
+        path = state_path('sessions', token)
+        if path is None:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(token)
+
+        if entry is None or now - entry[1] > self.ttl_seconds:
+            # Other processes may have served the session since this one last did
+            try:
+                last_access = os.stat(path).st_mtime
+            except OSError:
+                last_access = None if entry is None else entry[1]
+            if last_access is None or now - last_access > self.ttl_seconds:
+                with self._lock:
+                    self._sessions.pop(token, None)
+                return None
+        if entry is None:
+            entry = self._load(token)
+            if entry is None:
+                return None
+
+        with self._lock:
+            if token in self._sessions:
+                self._sessions.move_to_end(token)
+            entry[1] = now
+        # Keep the session alive for other processes without touching the file on every request
+        if now - entry[3] > SESSION_TOUCH_SECONDS:
+            entry[3] = now
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            touch_dataset(entry[0].version)
+
+        # Caches filled by earlier requests may have grown the parser since it was last sized
+        entry[2] = entry[0].memory_usage()
+        with self._lock:
+            self._evict()
+        return entry[0]
+
+    def _load(self, token):
+        """Load a session's dataset from the shared cache into this process"""
+        state = read_state('sessions', token)
+        if state is None or state_path('sessions', state.get('dataset')) is None:
+            return None
+        cache_path = os.path.join(app.config['CACHE_FOLDER'], state['dataset'])
+        try:
+            parser = DataParser.from_cache(cache_path)
+        except (OSError, KeyError, pa.ArrowException) as e:
+            app.logger.warning(f"Cannot load dataset of session {token[:6]}...: {e}")
+            return None
+        parser.version = state['dataset']
+        now = time.time()
+        entry = [parser, now, parser.memory_usage(), now]
+        with self._lock:
+            entry = self._sessions.setdefault(token, entry)
+        return entry
+
+    def __len__(self):
+        return len(self._sessions)
 
-# Store the most recent parser for the /api/data endpoints
-current_parser = None
+    def memory_usage(self):
+        """Combined estimated size of every loaded session's parser"""
+        with self._lock:
+            return sum(entry[2] for entry in self._sessions.values())
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    def _evict(self):
+        """Drop expired sessions, then the least recently used ones until under budget"""
+        now = time.time()
+        for token in [token for token, entry in self._sessions.items() if now - entry[1] > self.ttl_seconds]:
+            del self._sessions[token]
+
+        total = sum(entry[2] for entry in self._sessions.values())
+        # Never evict the most recently used session, even if it alone is over budget
+        while total > self.max_bytes and len(self._sessions) > 1:
+            token, entry = self._sessions.popitem(last=False)
+            app.logger.info(f"Unloading session {token[:6]}... from memory ({entry[2]} bytes)")
+            total -= entry[2]
+
+# Parsed datasets for the /api/data endpoints, one per upload session
+parser_registry = ParserRegistry(app.config['SESSION_MAX_BYTES'], app.config['SESSION_TTL_SECONDS'])
+
+def get_session_parser():
+    """Look up the DataParser of the session named by the request, if it is still loaded"""
+    token = request.headers.get(SESSION_HEADER) or request.args.get('session')
+    if not token:
+        return None
+    return parser_registry.get(token)
+
+class UploadJob:
+    """Status of an upload processed in the background, shared with other workers under <cache>/jobs
+
+    Phases: queued -> parsing -> aggregating -> caching -> done (or failed); `session` is set once done.
+    """
+    def __init__(self):
+        self.id = secrets.token_urlsafe(12)
+        self.phase = 'queued'
+        self.files_total = None
+        self.files_parsed = 0
+        self.rows_processed = 0
+        self.session = None
+        self.message = None
+        self.finished_at = None
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+        self._save(force=True)
+
+    def start_phase(self, phase, files_total=None):
+        with self._lock:
+            self.phase = phase
+            if files_total is not None:
+                self.files_total = files_total
+        self._save(force=True)
+
+    def advance(self, files=0, rows=0):
+        with self._lock:
+            self.files_parsed += files
+            self.rows_processed += rows
+        self._save()
+
+    def finish(self, session=None, message=None):
+        with self._lock:
+            self.phase = 'done' if session is not None else 'failed'
+            self.session = session
+            self.message = message
+            self.finished_at = time.monotonic()
+        self._save(force=True)
+
+    def _save(self, force=False):
+        """Write the status for other processes, at most every JOB_STATE_INTERVAL_SECONDS while running"""
+        now = time.monotonic()
+        if not force and now - self._saved_at < JOB_STATE_INTERVAL_SECONDS:
+            return
+        self._saved_at = now
+        try:
+            write_state('jobs', self.id, self.to_dict())
+        except OSError as e:
+            app.logger.warning(f"Cannot save status of upload {self.id}: {e}")
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'phase': self.phase,
+                'files_total': self.files_total,
+                'files_parsed': self.files_parsed,
+                'rows_processed': self.rows_processed,
+                'session': self.session,
+                'message': self.message
+            }
+
+# Background upload processing, with jobs kept around until their sessions would expire
+upload_executor = ThreadPoolExecutor(max_workers=app.config['UPLOAD_JOB_WORKERS'])
+upload_jobs = {}
+upload_jobs_lock = threading.Lock()
+
+def submit_upload_job(file_path, base_parser=None, digest=None):
+    """Queue an uploaded ZIP for processing and return its job
+
+    With a base_parser, the upload's plays are appended to that dataset instead.
+    digest is the SHA-256 of the upload, if already known.
+    """
+    job = UploadJob()
+    now = time.monotonic()
+    with upload_jobs_lock:
+        for job_id in [job_id for job_id, old_job in upload_jobs.items()
+                       if old_job.finished_at is not None
+                       and now - old_job.finished_at > app.config['SESSION_TTL_SECONDS']]:
+            del upload_jobs[job_id]
+        upload_jobs[job.id] = job
+    prune_state('jobs', app.config['SESSION_TTL_SECONDS'])
+    prune_cache(max(app.config['CACHE_TTL_SECONDS'], app.config['SESSION_TTL_SECONDS']))
+    upload_executor.submit(run_upload_job, job, file_path, base_parser, digest)
+    return job
+
+def run_upload_job(job, file_path, base_parser=None, digest=None):
+    """Parse and aggregate an upload, then hand the result to a new session"""
+    try:
+        if digest is None:
+            digest = hash_file(file_path)
+        if base_parser is not None:
+            # Named after its parts, so appending the same export again reuses the cache
+            version = hashlib.sha256(f"{base_parser.version}+{digest}".encode()).hexdigest()
+            if app.config['AGGREGATION_MAX_BYTES']:
+                data_parser = DataParser.from_zip_chunked(
+                    file_path, os.path.join(app.config['CACHE_FOLDER'], version),
+                    app.config['AGGREGATION_MAX_BYTES'], progress=job, base_parser=base_parser
+                )
+            else:
+                job.start_phase('parsing', files_total=len(list_streaming_history_members(file_path)))
+                new_plays = load_play_frame_from_zip(file_path, progress=job)
+                job.start_phase('aggregating')
+                data_parser = base_parser.append(new_plays)
+            if data_parser is not base_parser:
+                data_parser.version = version
+                job.start_phase('caching')
+        else:
+            data_parser = load_dataset(file_path, progress=job, digest=digest)
+        job.finish(session=start_session(data_parser), message='Files processed successfully!')
+    except zipfile.BadZipFile:
+        job.finish(message='Invalid ZIP file')
+    except ValueError as e:
+        job.finish(message=str(e))
+    except Exception as e:
+        app.logger.exception(f"Error processing upload {job.id}: {e}")
+        job.finish(message=f'Error processing upload: {str(e)}')
+    finally:
+        # Its plays are in the cache (or the session) now, if anywhere
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+    # The job's stages would otherwise wait for this worker's next request to show up
+    metrics_publisher.publish(force=True)
+
+app.request_class = UploadRequest
 
 @app.route('/')
 def index():
@@ -384,96 +1456,351 @@ def index():
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    global current_parser
-    
-    if 'file' not in request.files:
-        return jsonify({'message': 'No file part'}), 400
+    """Accept an export ZIP for background processing
+
+    Sending the form field append=true along with a session token merges the
+    upload into that session's dataset rather than starting from scratch.
+    """
+    try:
+        # Receiving the body streams the upload to disk (see UploadReceipt)
+        if 'file' not in request.files:
+            return jsonify({'message': 'No file part'}), 400
+    except RequestEntityTooLarge:
+        return jsonify({'message': f"File is larger than the {app.config['MAX_CONTENT_LENGTH'] // 1024 ** 2} MB upload limit"}), 413
+    except BadRequest as e:
+        return jsonify({'message': e.description}), 400
     
     file = request.files['file']
+
+    base_parser = None
+    if request.form.get('append', '').lower() == 'true':
+        base_parser = get_session_parser()
+        if base_parser is None:
+            return jsonify({'message': 'No data available to append to. Please upload a file first.'}), 404
     
     if file and allowed_file(file.filename):
-        file_name = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_name)
-        file.save(file_path)
-
-        json_data = load_json_data_from_zip(file_name, file_path)
+        try:
+            digest = file.stream.finish()
+        except zipfile.BadZipFile:
+            return jsonify({'message': 'Invalid ZIP file'}), 400
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        # Named after the contents, and unique so that a job deleting its upload
+        # never takes away another's
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{digest}-{secrets.token_hex(4)}.zip")
+        file.stream.keep(file_path)
 
-        # Create new parser and process the data
-        data_parser = DataParser(json_data)
-        current_parser = data_parser  # Update the current parser
-        
-        # Process all data at once for faster subsequent access
-        song_df = data_parser.parse()
-        album_df = data_parser.get_album_aggregation(song_df)
-        artist_df = data_parser.get_artist_aggregation(song_df)
-        
-        # Convert to records format for JSON serialization
-        song_data = song_df.to_dict(orient="records")
-        album_data = album_df.to_dict(orient="records")
-        artist_data = artist_df.to_dict(orient="records")
-        
-        # Pre-sort data by plays for common use case
-        data_parser.get_sorted_data('song', 'Plays', 'desc')
-        data_parser.get_sorted_data('album', 'Plays', 'desc')
-        data_parser.get_sorted_data('artist', 'Plays', 'desc')
-        
-        # Return all three aggregation levels
-        response_data = {
-            'song': song_data,
-            'album': album_data,
-            'artist': artist_data
-        }
-        
-        return jsonify({'message': 'Files processed successfully!', 'data': response_data}), 200
+        # Parsing runs in the background; the client polls /api/jobs/<id> and then
+        # fetches the tables through /api/data with the job's session token
+        job = submit_upload_job(file_path, base_parser, digest)
+        return jsonify({'message': 'Upload accepted, processing started', 'job': job.id}), 202
     
     return jsonify({'message': 'Invalid file type'}), 400
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Endpoint to report the phase and progress of a background upload"""
+    with upload_jobs_lock:
+        job = upload_jobs.get(job_id)
+    # Jobs running in other worker processes report through their status files
+    status = job.to_dict() if job is not None else read_state('jobs', job_id)
+    if status is None:
+        return jsonify({'message': 'Unknown job'}), 404
+    return jsonify(status), 200
+
+def parse_month_arg(name, round_up=False):
+    """Read a start/end time argument as a month offset from 1970-01
+
+    Takes epoch seconds or a date (UTC if naive). round_up snaps to the start of the next month,
+    and takes a bare year or year-month to mean the end of that year or month.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    period_months = 0
+    try:
+        # Bare numbers are epoch seconds, except four digits or fewer, which are years
+        if value.lstrip('-').isdigit() and len(value.lstrip('-')) > 4:
+            timestamp = pd.Timestamp(int(value), unit='s')
+        else:
+            timestamp = pd.Timestamp(value)
+            if value.isdigit():
+                period_months = 12
+            elif re.fullmatch(r'\d{4}-\d{1,2}', value):
+                period_months = 1
+    except (ValueError, OverflowError):
+        timestamp = pd.NaT
+    if pd.isna(timestamp):
+        raise ValueError(f'{name} must be a date or a number of seconds since the epoch')
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+
+    month = (timestamp.year - 1970) * 12 + timestamp.month - 1
+    if round_up and period_months:
+        month += period_months
+    elif round_up and timestamp != pd.Timestamp(year=timestamp.year, month=timestamp.month, day=1):
+        month += 1
+    return month
+
+def month_start(month):
+    """ISO date of the first day of a month offset from 1970-01"""
+    return str(np.datetime64(month, 'M').astype('datetime64[D]'))
+
+def parse_range_args():
+    """Read the start/end arguments of a data request as a range of months
+
+    Returns (first month, month after the last) or None without either argument;
+    an open end reaches back to 1970 or forward past the last play.
+    """
+    start = parse_month_arg('start')
+    end = parse_month_arg('end', round_up=True)
+    if start is None and end is None:
+        return None
+    start = 0 if start is None else start
+    end = np.iinfo(np.int32).max if end is None else end
+    if end <= start:
+        raise ValueError('end must be after start')
+    return start, end
+
+def parse_page_args():
+    """Read the offset/limit/columns/q paging arguments of a data request"""
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = request.args.get('limit')
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        raise ValueError('offset and limit must be integers')
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError('offset and limit must not be negative')
+
+    columns = [column.strip() for column in request.args.get('columns', '').split(',') if column.strip()]
+    return {
+        'offset': offset,
+        'limit': limit,
+        'columns': columns or None,
+        'query': request.args.get('q'),
+    }
+
+class RawJSON(str):
+    """Already-encoded JSON that json_response inserts verbatim"""
+
+@instrumented('serialize')
+def encode_table(df, table_format='records'):
+    """Encode a table straight from its columns with pandas' C JSON encoder
+
+    'records' gives a list of row objects. 'columns' gives the column names once
+    and one array of values per column, which is much smaller for big tables.
+    """
+    if table_format == 'columns':
+        columns = json.dumps([str(column) for column in df.columns], separators=(",", ":"))
+        values = ','.join(df[column].to_json(orient='values') for column in df.columns)
+        return RawJSON(f'{{"columns":{columns},"data":[{values}]}}')
+    return RawJSON(df.to_json(orient='records'))
+
+def encode_json(value):
+    """Encode a response payload, splicing in any RawJSON values of its (nested) dicts"""
+    if isinstance(value, RawJSON):
+        return value
+    if isinstance(value, dict):
+        return '{' + ','.join(f'{json.dumps(str(key))}:{encode_json(item)}' for key, item in value.items()) + '}'
+    return json.dumps(value)
+
+def json_response(payload, status=200):
+    """Build a JSON response for a payload that may hold pre-encoded tables"""
+    return app.response_class(encode_json(payload), status=status, mimetype='application/json')
+
+def get_table_format():
+    """Read the format argument of a request that returns tables"""
+    table_format = request.args.get('format', 'records')
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(TABLE_FORMATS)}")
+    return table_format
+
+# Registered ahead of the other after_request hooks, so that it runs after them and
+# its timings include compression
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    if app.config['PROFILING_ENABLED'] and request.args.get('profile') == '1':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def finish_request_timing(response):
+    """Record the request's duration and report its stages in a Server-Timing header
+
+    A profiled request gets its cProfile report, by cumulative time, as the response.
+    """
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_REPORT_LINES)
+        profiled_status = response.status_code
+        response = app.response_class(report.getvalue(), mimetype='text/plain')
+        response.headers['X-Profiled-Status'] = str(profiled_status)
+
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    request_metrics.observe((request.endpoint or 'unmatched', request.method, str(response.status_code)), elapsed)
+    metrics_publisher.publish()
+
+    timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in g.get('stage_timings', {}).items()]
+    timings.append(f"total;dur={elapsed * 1000:.1f}")
+    response.headers['Server-Timing'] = ', '.join(timings)
+    response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+def negotiate_encoding():
+    """Pick the content coding for a response from the request's Accept-Encoding"""
+    return request.accept_encodings.best_match(CONTENT_ENCODINGS, default='identity')
+
+def compress_body(body, encoding, levels=LIVE_COMPRESSION_LEVELS):
+    if encoding == 'br':
+        return brotli.compress(body, quality=levels['br'])
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=levels['gzip'], mtime=0)
+    return body
+
+def compress_response(response, encoding, levels=LIVE_COMPRESSION_LEVELS):
+    """Compress a JSON response body in place if the client accepts it and it's worth it"""
+    response.vary.add('Accept-Encoding')
+    if (encoding == 'identity' or response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype != 'application/json'):
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    with timed_stage('compress'):
+        response.set_data(compress_body(body, encoding, levels))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.after_request
+def compress_json_responses(response):
+    if response.mimetype == 'application/json':
+        compress_response(response, negotiate_encoding())
+    return response
+
+def response_etag(current_parser, encoding):
+    """Strong ETag for the current request: the dataset version, path, query and content coding"""
+    query = sorted((key, value) for key, value in request.args.items(multi=True) if key != 'session')
+    fingerprint = json.dumps([current_parser.version, request.path, query, encoding])
+    return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:32]
+
+def is_default_table_view():
+    """Whether the request is for a whole table in its default order (Plays, descending)"""
+    # Anything else, cache busters included, would each get a body of its own
+    if any(arg not in DEFAULT_VIEW_ARGS for arg in request.args):
+        return False
+    return (request.args.get('column', 'Plays').lower() == 'plays'
+            and request.args.get('direction', 'desc') == 'desc')
+
+def conditional_view(view):
+    """Make a session data endpoint revalidatable by ETag and serve its hottest bodies precompressed"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        current_parser = get_session_parser()
+        if current_parser is None:
+            return view(*args, **kwargs)
+
+        encoding = negotiate_encoding()
+        etag = response_etag(current_parser, encoding)
+        cacheable = encoding != 'identity' and request.endpoint in ('get_data', 'get_sorted_data') and is_default_table_view()
+        # get_data serves a table in its own order, get_sorted_data by plays
+        cache_key = (request.endpoint, request.view_args.get('aggregation_level'),
+                     request.args.get('format', 'records'), encoding)
+
+        body = current_parser.get_cached(current_parser.response_cache, cache_key) if cacheable else None
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        elif body is not None:
+            response = app.response_class(body, mimetype='application/json')
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if cacheable:
+                compress_response(response, encoding, CACHED_COMPRESSION_LEVELS)
+                if response.headers.get('Content-Encoding') == encoding:
+                    current_parser.put_cached(current_parser.response_cache, cache_key, response.get_data(),
+                                              RESPONSE_CACHE_SIZE)
+            else:
+                compress_response(response, encoding)
+
+        response.set_etag(etag)
+        response.vary.update(['Accept-Encoding', SESSION_HEADER])
+        # Session data is per user and must be revalidated before each reuse
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+def get_page_response(current_parser, aggregation_level, sort_column=None, direction='desc'):
+    """Serve one filtered, projected page of a table (the whole table by default)
+
+    With start/end the table covers just the plays of that range of months.
+    """
+    try:
+        table_format = get_table_format()
+        page_args = parse_page_args()
+        month_range = parse_range_args()
+        if month_range is not None:
+            current_parser = current_parser.get_range_view(*month_range)
+        page_df, total = current_parser.get_page(aggregation_level, sort_column, direction, **page_args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    payload = {
+        'data': encode_table(page_df, table_format),
+        'total': total,
+        'offset': page_args['offset'],
+        'limit': page_args['limit']
+    }
+    if month_range is not None:
+        start, end = month_range
+        payload['start'] = month_start(start) if start > 0 else None
+        payload['end'] = month_start(end) if end < np.iinfo(np.int32).max else None
+    return json_response(payload)
+
 @app.route('/api/data/<aggregation_level>', methods=['GET'])
+@conditional_view
 def get_data(aggregation_level):
-    """Endpoint to get data at specific aggregation level without reuploading"""
-    global current_parser
-    
+    """Endpoint to get data at specific aggregation level without reuploading
+
+    offset, limit, columns or q return one page, start/end a range of months, format=columns arrays.
+    The range ends before end, except that a bare year or year-month end includes that year or
+    month, so start=2023&end=2023 covers all of 2023. end must come after start.
+    """
+    current_parser = get_session_parser()
     if current_parser is None:
         return jsonify({'message': 'No data available. Please upload a file first.'}), 404
 
-    if aggregation_level == 'song':
-        data = current_parser.parse().to_dict(orient="records")
-    elif aggregation_level == 'album':
-        data = current_parser.get_album_aggregation().to_dict(orient="records")
-    elif aggregation_level == 'artist':
-        data = current_parser.get_artist_aggregation().to_dict(orient="records")
-    else:
-        return jsonify({'message': 'Invalid aggregation level'}), 400
-    
-    return jsonify({'data': data}), 200
+    return get_page_response(current_parser, aggregation_level)
 
 @app.route('/api/data/<aggregation_level>/sort', methods=['GET'])
+@conditional_view
 def get_sorted_data(aggregation_level):
-    """Endpoint to get pre-sorted data for faster rendering"""
-    global current_parser
-    
+    """Endpoint to get pre-sorted data for faster rendering
+
+    Takes the same paging and start/end range arguments as get_data.
+    """
+    current_parser = get_session_parser()
     if current_parser is None:
         return jsonify({'message': 'No data available. Please upload a file first.'}), 404
         
+    # Column names are matched case-insensitively, falling back to Plays
     sort_column = request.args.get('column', 'Plays')
     direction = request.args.get('direction', 'desc')
-    
-    # Ensure the column name exists in the data
-    data = current_parser.get_sorted_data(aggregation_level, sort_column, direction)
-    
-    # If empty result, check if column may have a different case
-    if not data and sort_column not in ['Plays', 'Minutes Played', 'Albums', 'Songs']:
-        # Try with first letter capitalized 
-        sort_column_cap = sort_column.capitalize()
-        data = current_parser.get_sorted_data(aggregation_level, sort_column_cap, direction)
-    
-    return jsonify({'data': data}), 200
+
+    return get_page_response(current_parser, aggregation_level, sort_column, direction)
 
 @app.route('/api/data/detail/<detail_type>/<detail_name>', methods=['GET'])
+@conditional_view
 def get_detail_data(detail_type, detail_name):
     """Get detailed data for a specific album or artist"""
-    global current_parser
-    
+    current_parser = get_session_parser()
     if current_parser is None:
         return jsonify({'message': 'No data available. Please upload a file first.'}), 404
     
@@ -483,33 +1810,23 @@ def get_detail_data(detail_type, detail_name):
     if song_data.empty:
         return jsonify({'message': 'No data available'}), 404
     
-    # Filter based on the detail type
-    if detail_type == 'album':
-        filtered_data = song_data[song_data['Album'] == detail_name]
-    elif detail_type == 'artist':
-        filtered_data = song_data[song_data['Artist'] == detail_name]
-    else:
+    if detail_type not in DETAIL_COLUMNS:
         return jsonify({'message': 'Invalid detail type'}), 400
+
+    try:
+        table_format = get_table_format()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    # Look up the album or artist's songs, sorted by plays, and their precomputed summary
+    filtered_data, summary = current_parser.get_detail(detail_type, detail_name)
     
-    # Sort by plays descending
-    filtered_data = filtered_data.sort_values('Plays', ascending=False)
-    
-    # Convert to records format for JSON serialization
-    detail_data = filtered_data.to_dict(orient="records")
-    
-    # Get some summary statistics
-    summary = {
-        'total_plays': int(filtered_data['Plays'].sum()),
-        'total_minutes': float(filtered_data['Minutes Played'].sum()),
-        'song_count': len(filtered_data)
-    }
-    
-    return jsonify({
-        'data': detail_data,
+    return json_response({
+        'data': encode_table(filtered_data, table_format),
         'summary': summary,
         'name': detail_name,
         'type': detail_type
-    }), 200
+    })
 
 @app.route('/api/demo-data', methods=['GET'])
 def load_demo_data():
@@ -521,27 +1838,22 @@ def load_demo_data():
         if not os.path.exists(demo_data_name):
             return jsonify({'message': 'Demo data not found'}), 404
         
-        json_data = load_json_data_from_zip(demo_data_name, demo_data_name)
-        
         # Create a new parser instance with the demo data
-        global current_parser
-        data_parser = DataParser(json_data)
-        current_parser = data_parser
+        data_parser = load_dataset(demo_data_name)
         
         # Process all data at once for faster subsequent access
         song_df = data_parser.parse()
         album_df = data_parser.get_album_aggregation(song_df)
         artist_df = data_parser.get_artist_aggregation(song_df)
         
-        # Convert to records format for JSON serialization
-        song_data = song_df.to_dict(orient="records")
-        album_data = album_df.to_dict(orient="records")
-        artist_data = artist_df.to_dict(orient="records")
+        # Encode the tables for the response straight from their columns
+        song_data = encode_table(song_df)
+        album_data = encode_table(album_df)
+        artist_data = encode_table(artist_df)
         
-        # Pre-sort data by plays for common use case
-        data_parser.get_sorted_data('song', 'Plays', 'desc')
-        data_parser.get_sorted_data('album', 'Plays', 'desc')
-        data_parser.get_sorted_data('artist', 'Plays', 'desc')
+        # Pre-sort data by plays for common use case, then hand the parser to a new
+        # session; the client sends the token back on later requests
+        session_token = start_session(data_parser)
         
         # Return all three aggregation levels
         response_data = {
@@ -550,18 +1862,18 @@ def load_demo_data():
             'artist': artist_data
         }
         
-        return jsonify({'message': 'Demo data loaded successfully!', 'data': response_data}), 200
+        return json_response({'message': 'Demo data loaded successfully!', 'session': session_token, 'data': response_data})
         
     except Exception as e:
-        print(f"Error loading demo data: {e}")
+        app.logger.exception(f"Error loading demo data: {e}")
         return jsonify({'message': f'Error loading demo data: {str(e)}'}), 500
 
 
 @app.route('/api/monthly-top-songs', methods=['GET'])
+@conditional_view
 def get_monthly_top_songs():
     """Endpoint to get the top songs for each month"""
-    global current_parser
-    
+    current_parser = get_session_parser()
     if current_parser is None:
         return jsonify({'message': 'No data available. Please upload a file first.'}), 404
     
@@ -570,5 +1882,137 @@ def get_monthly_top_songs():
     
     return jsonify({'data': monthly_top_songs}), 200
 
+def parse_search_args():
+    """Read the q/type/limit arguments of a search request"""
+    query = request.args.get('q')
+    if query is None:
+        raise ValueError('q is required')
+    types = [level.strip() for level in request.args.get('type', '').split(',') if level.strip()]
+    unknown = [level for level in types if level not in SEARCH_TYPES]
+    if unknown:
+        raise ValueError(f"type must be one or more of: {', '.join(SEARCH_TYPES)}")
+    try:
+        limit = int(request.args.get('limit', SEARCH_RESULT_LIMIT))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 0 <= limit <= SEARCH_MAX_LIMIT:
+        raise ValueError(f'limit must be between 0 and {SEARCH_MAX_LIMIT}')
+    return query, types or None, limit
+
+@app.route('/api/search', methods=['GET'])
+@conditional_view
+def search():
+    """Endpoint to search song, album and artist names as the user types, ignoring case and accents"""
+    current_parser = get_session_parser()
+    if current_parser is None:
+        return jsonify({'message': 'No data available. Please upload a file first.'}), 404
+
+    try:
+        table_format = get_table_format()
+        query, types, limit = parse_search_args()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    if current_parser.parse().empty:
+        results, total = pd.DataFrame(columns=['Type', 'Name', 'Artist', 'Album', 'Plays', 'Minutes Played']), 0
+    else:
+        results, total = current_parser.get_search_index().search(query, types, limit)
+    return json_response({
+        'query': query,
+        'data': encode_table(results, table_format),
+        'total': total,
+    })
+
+def parse_tz_arg():
+    """Read the tz argument of an analytics request as an IANA time zone name (UTC by default)"""
+    tz = request.args.get('tz', 'UTC')
+    try:
+        ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f'Unknown time zone: {tz}')
+    return tz
+
+def parse_skip_table_args():
+    """Read the min_plays/limit arguments of the per-song skip table"""
+    try:
+        min_plays = int(request.args.get('min_plays', SKIP_TABLE_MIN_PLAYS))
+        limit = int(request.args.get('limit', SKIP_TABLE_LIMIT))
+    except ValueError:
+        raise ValueError('min_plays and limit must be integers')
+    if min_plays < 0 or limit < 0:
+        raise ValueError('min_plays and limit must not be negative')
+    return min_plays, limit
+
+def analytics_payload(analytics, view, table_format):
+    """Response body of one analytics view, with its tables encoded"""
+    if view == 'skips':
+        min_plays, limit = parse_skip_table_args()
+        songs = analytics['skips']['songs']
+        songs = songs[songs['Plays'] >= min_plays]
+        return {
+            **{key: value for key, value in analytics['skips'].items() if key != 'songs'},
+            'songs': encode_table(songs.head(limit), table_format),
+            'total': len(songs),
+        }
+    if view == 'platforms':
+        return encode_table(analytics['platforms'], table_format)
+    return analytics[view]
+
+@app.route('/api/analytics', methods=['GET'])
+@app.route('/api/analytics/<view>', methods=['GET'])
+@conditional_view
+def get_analytics(view=None):
+    """Endpoint to get listening-habit analytics: heatmap, streaks, skips and platforms"""
+    current_parser = get_session_parser()
+    if current_parser is None:
+        return jsonify({'message': 'No data available. Please upload a file first.'}), 404
+    if view is not None and view not in ANALYTICS_VIEWS:
+        return jsonify({'message': f"Invalid analytics view. Use one of: {', '.join(ANALYTICS_VIEWS)}"}), 400
+
+    try:
+        table_format = get_table_format()
+        tz = parse_tz_arg()
+        analytics = current_parser.get_analytics(tz)
+        views = ANALYTICS_VIEWS if view is None else [view]
+        payload = {name: analytics_payload(analytics, name, table_format) for name in views}
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return json_response({'tz': tz, **payload})
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Endpoint exposing stage and request timings, memory and sessions in the Prometheus text format
+
+    Every worker process publishes its own metrics (see MetricsPublisher), so any of
+    them can answer with the totals across all of them.
+    """
+    metrics_publisher.publish(force=True)
+    stages, requests, totals = collect_metrics(os.path.join(app.config['CACHE_FOLDER'], 'metrics'))
+
+    lines = []
+    prometheus_histogram(lines, 'spotify_stage_duration_seconds', 'Time spent in each processing stage.',
+                         ['stage'], stages)
+    lines.append("# HELP spotify_stage_memory_growth_bytes Largest growth of resident memory seen during a stage.")
+    lines.append("# TYPE spotify_stage_memory_growth_bytes gauge")
+    for (stage,), entry in sorted(stages.items()):
+        lines.append(f"spotify_stage_memory_growth_bytes{{{prometheus_labels(['stage'], [stage])}}} {entry['memory_growth']}")
+    prometheus_histogram(lines, 'spotify_http_request_duration_seconds', 'Time spent serving requests.',
+                         ['endpoint', 'method', 'status'], requests)
+
+    gauges = [
+        ('spotify_sessions', 'Datasets currently loaded in memory.', totals.get('sessions', 0)),
+        ('spotify_session_memory_bytes', 'Estimated memory held by loaded datasets.', totals.get('session_memory_bytes', 0)),
+        ('spotify_upload_jobs_running', 'Uploads queued or being processed.', totals.get('upload_jobs_running', 0)),
+        ('process_resident_memory_bytes', 'Resident memory of the worker processes.', totals.get('resident_memory_bytes', 0)),
+    ]
+    for name, help_text, value in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
+    # Development server; start_backend.sh serves production traffic with gunicorn
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""Generate synthetic Spotify extended streaming history exports for benchmarking
+
+The ZIP has the layout of a real export: chronologically split
+Streaming_History_Audio_<years>_<n>.json files under
+"Spotify Extended Streaming History/", each a JSON array of plays with every field
+Spotify includes. Track popularity follows a Zipf distribution (a few songs make up
+most plays, with a long tail of one-off listens) and podcast episodes, which carry
+no track metadata, are mixed in.
+
+Usage: python benchmarks/generate_export.py --plays 1000000 --output export.zip
+"""
+import argparse
+import json
+import zipfile
+
+import numpy as np
+
+EXPORT_FOLDER = 'Spotify Extended Streaming History'
+# Real exports split the history into files of roughly this many plays
+PLAYS_PER_FILE = 16_000
+SYLLABLES = [
+    'la', 'mo', 'ri', 'ven', 'ka', 'tor', 'el', 'sun', 'day', 'ne', 'sha', 'lo',
+    'rex', 'mi', 'ta', 'ghost', 'blue', 'fire', 'is', 'an', 'del', 'zé', 'bö', 'ñu',
+]
+PLATFORMS = ['android', 'ios', 'windows', 'osx', 'web_player', 'cast_to_device']
+COUNTRIES = ['US', 'GB', 'DE', 'SE', 'BR', 'MX', 'CA', 'FR']
+REASONS_START = ['trackdone', 'clickrow', 'fwdbtn', 'backbtn', 'playbtn', 'appload']
+REASONS_END = ['trackdone', 'fwdbtn', 'endplay', 'logout', 'unexpected-exit']
+
+
+def make_names(rng, count, words=(1, 3)):
+    """Random title-cased names of a few made-up words each, mostly unique"""
+    syllables = rng.integers(0, len(SYLLABLES), size=(count, words[1], 3))
+    lengths = rng.integers(words[0], words[1] + 1, size=count)
+    names = []
+    for index in range(count):
+        name = ' '.join(
+            ''.join(SYLLABLES[s] for s in word).capitalize()
+            for word in syllables[index, :lengths[index]]
+        )
+        names.append(name)
+    return names
+
+
+def make_catalog(rng, track_count, zipf):
+    """Tracks with artists, albums, URIs, durations and Zipf popularity weights"""
+    artist_count = max(10, track_count // 12)
+    artists = make_names(rng, artist_count, (1, 2))
+    # Popular artists have more songs as well as more plays per song
+    artist_weights = 1.0 / np.arange(1, artist_count + 1) ** zipf
+    track_artists = rng.choice(artist_count, size=track_count, p=artist_weights / artist_weights.sum())
+
+    # Group each artist's songs into albums of about ten tracks
+    order = np.argsort(track_artists, kind='stable')
+    album_numbers = np.empty(track_count, dtype=np.int64)
+    _, first_positions, counts = np.unique(track_artists[order], return_index=True, return_counts=True)
+    for start, count in zip(first_positions, counts):
+        album_numbers[order[start:start + count]] = np.arange(count) // 10
+    album_titles = make_names(rng, track_count // 10 + artist_count, (1, 3))
+
+    track_weights = 1.0 / np.arange(1, track_count + 1) ** zipf
+    return {
+        'names': make_names(rng, track_count),
+        'artists': [artists[a] for a in track_artists],
+        'albums': [album_titles[(a * 7919 + n) % len(album_titles)] for a, n in zip(track_artists, album_numbers)],
+        'uris': [f'spotify:track:{uri:022x}' for uri in rng.integers(0, 2 ** 62, size=track_count)],
+        'durations': rng.integers(90_000, 360_000, size=track_count),
+        # Cumulative popularity, for sampling tracks by binary search
+        'popularity': np.cumsum(track_weights / track_weights.sum()),
+    }
+
+
+def make_shows(rng, show_count=40, episodes_per_show=60):
+    shows = make_names(rng, show_count, (2, 3))
+    return {
+        'shows': [shows[i // episodes_per_show] for i in range(show_count * episodes_per_show)],
+        'names': make_names(rng, show_count * episodes_per_show, (2, 3)),
+        'uris': [f'spotify:episode:{uri:022x}' for uri in rng.integers(0, 2 ** 62, size=show_count * episodes_per_show)],
+    }
+
+
+def iso_timestamps(seconds):
+    return np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s').astype(object) + 'Z'
+
+
+def make_plays(rng, catalog, shows, start_seconds, end_seconds, count, podcast_fraction):
+    """One file's worth of plays as export records, in time order"""
+    ts = np.sort(rng.integers(start_seconds, end_seconds, size=count))
+    is_podcast = rng.random(count) < podcast_fraction
+    tracks = np.searchsorted(catalog['popularity'], rng.random(count) * catalog['popularity'][-1], side='right')
+    tracks = np.minimum(tracks, len(catalog['names']) - 1)
+    episodes = rng.integers(0, len(shows['names']), size=count)
+    # About a quarter of plays are skipped partway through
+    skipped = rng.random(count) < 0.25
+    fraction = np.where(skipped, rng.random(count) * 0.6, 1.0)
+    ms_played = (catalog['durations'][tracks] * fraction).astype(np.int64)
+    ms_played[is_podcast] = rng.integers(60_000, 3_600_000, size=int(is_podcast.sum()))
+    platforms = rng.integers(0, len(PLATFORMS), size=count)
+    countries = rng.integers(0, len(COUNTRIES), size=count)
+    reasons_start = rng.integers(0, len(REASONS_START), size=count)
+    reasons_end = rng.integers(0, len(REASONS_END), size=count)
+    shuffle = rng.random(count) < 0.4
+    offline = rng.random(count) < 0.05
+    timestamps = iso_timestamps(ts)
+
+    plays = []
+    for i in range(count):
+        podcast = bool(is_podcast[i])
+        track = int(tracks[i])
+        episode = int(episodes[i])
+        plays.append({
+            'ts': timestamps[i],
+            'platform': PLATFORMS[platforms[i]],
+            'ms_played': int(ms_played[i]),
+            'conn_country': COUNTRIES[countries[i]],
+            'ip_addr': f'10.{i % 256}.{(i // 256) % 256}.1',
+            'master_metadata_track_name': None if podcast else catalog['names'][track],
+            'master_metadata_album_artist_name': None if podcast else catalog['artists'][track],
+            'master_metadata_album_album_name': None if podcast else catalog['albums'][track],
+            'spotify_track_uri': None if podcast else catalog['uris'][track],
+            'episode_name': shows['names'][episode] if podcast else None,
+            'episode_show_name': shows['shows'][episode] if podcast else None,
+            'spotify_episode_uri': shows['uris'][episode] if podcast else None,
+            'audiobook_title': None,
+            'audiobook_uri': None,
+            'audiobook_chapter_uri': None,
+            'audiobook_chapter_title': None,
+            'reason_start': REASONS_START[reasons_start[i]],
+            'reason_end': 'fwdbtn' if skipped[i] else REASONS_END[reasons_end[i]],
+            'shuffle': bool(shuffle[i]),
+            'skipped': bool(skipped[i]),
+            'offline': bool(offline[i]),
+            'offline_timestamp': int(ts[i]) * 1000 if offline[i] else None,
+            'incognito_mode': False,
+        })
+    return plays
+
+
+def generate_export(output_path, plays, seed=0, zipf=1.1, podcast_fraction=0.05,
+                    tracks=None, start='2015-01-01', end='2025-01-01', plays_per_file=PLAYS_PER_FILE):
+    """Write a synthetic export ZIP and return a summary of what it contains
+
+    By default the catalog holds one track per eight plays (at least 500), which keeps
+    the share of distinct songs close to that of real listening histories.
+    """
+    rng = np.random.default_rng(seed)
+    track_count = tracks or min(max(500, plays // 8), 2_000_000)
+    catalog = make_catalog(rng, track_count, zipf)
+    shows = make_shows(rng)
+
+    start_seconds = int(np.datetime64(start, 's').astype(np.int64))
+    end_seconds = int(np.datetime64(end, 's').astype(np.int64))
+    file_count = max(1, -(-plays // plays_per_file))
+    # Files cover consecutive slices of the time span, like the yearly splits of an export
+    bounds = np.linspace(start_seconds, end_seconds, file_count + 1).astype(np.int64)
+
+    with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as export:
+        for index in range(file_count):
+            count = min(plays_per_file, plays - index * plays_per_file)
+            records = make_plays(rng, catalog, shows, bounds[index], bounds[index + 1], count, podcast_fraction)
+            first_year = str(np.datetime64(int(bounds[index]), 's').astype('datetime64[Y]'))
+            last_year = str(np.datetime64(int(bounds[index + 1]) - 1, 's').astype('datetime64[Y]'))
+            name = f'{EXPORT_FOLDER}/Streaming_History_Audio_{first_year}-{last_year}_{index}.json'
+            with export.open(name, 'w') as member:
+                member.write(json.dumps(records, indent=2, ensure_ascii=False).encode('utf-8'))
+
+    return {
+        'plays': plays,
+        'files': file_count,
+        'tracks': track_count,
+        'zipf': zipf,
+        'podcast_fraction': podcast_fraction,
+        'seed': seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--plays', type=int, default=100_000, help='number of plays to generate')
+    parser.add_argument('--output', default='synthetic_export.zip', help='path of the ZIP to write')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the track popularity distribution')
+    parser.add_argument('--podcast-fraction', type=float, default=0.05, help='share of plays that are podcast episodes')
+    parser.add_argument('--tracks', type=int, help='catalog size (defaults to plays / 8)')
+    args = parser.parse_args()
+
+    summary = generate_export(
+        args.output, args.plays, seed=args.seed, zipf=args.zipf,
+        podcast_fraction=args.podcast_fraction, tracks=args.tracks
+    )
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
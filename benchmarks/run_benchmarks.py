@@ -0,0 +1,250 @@
+"""Time and measure the memory of each stage of the backend on synthetic exports
+
+For every requested size a synthetic export is generated (see generate_export.py)
+and pushed through the same steps as an upload: parsing the ZIP, the song, album and
+artist rollup, the monthly aggregation, sorting and paging, name search, time ranges,
+listening analytics, the Feather cache, chunked aggregation within a memory
+ceiling, and finally the /api/upload endpoint itself through Flask's test client.
+
+Each stage is timed in a first pass and run again under tracemalloc in a second
+pass for its peak of traced allocations, since tracing slows pure Python code down
+considerably. Results are written as JSON; pass an earlier result file as
+--baseline to print how each stage changed.
+
+Usage: python benchmarks/run_benchmarks.py --plays 10000 100000 1000000 --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app  # noqa: E402
+from app import DataParser  # noqa: E402
+from generate_export import generate_export  # noqa: E402
+
+# Upload jobs are polled at this interval
+JOB_POLL_SECONDS = 0.01
+# Memory ceiling of the chunked aggregation stage
+CHUNKED_MAX_BYTES = 64 * 2 ** 20
+
+
+def run_stages(export_path, work_dir, include_upload=True):
+    """Yield (stage name, callable) pairs that run the pipeline step by step
+
+    Later stages use the state left by earlier ones, just like the app does.
+    """
+    state = {}
+
+    def parse_zip():
+        state['plays'] = app.load_play_frame_from_zip(export_path)
+    yield 'parse_zip', parse_zip
+
+    def rollup():
+        # Song, album and artist tables come out of the one pass
+        state['parser'] = DataParser(state['plays'])
+        state['parser'].parse()
+    yield 'rollup', rollup
+
+    yield 'monthly_aggregation', lambda: state['parser'].get_monthly_aggregation()
+    yield 'monthly_top_songs', lambda: state['parser'].get_monthly_top_songs(top_count=10)
+    yield 'song_months', lambda: state['parser'].get_song_months()
+    yield 'sort_songs_first', lambda: state['parser'].get_sorted_data('song', 'Minutes Played', 'desc', limit=100)
+    yield 'sort_songs_cached', lambda: state['parser'].get_sorted_data('song', 'Minutes Played', 'asc', limit=100)
+    yield 'sort_songs_full', lambda: state['parser'].get_sorted_data('song', 'Plays', 'desc')
+    yield 'search_songs', lambda: state['parser'].get_page('song', 'Plays', query='la', limit=100)
+    yield 'encode_songs', lambda: app.encode_table(state['parser'].parse(), 'columns')
+    yield 'search_index', lambda: state['parser'].get_search_index()
+    yield 'search_prefix', lambda: state['parser'].get_search_index().search('la')
+    yield 'search_substring', lambda: state['parser'].get_search_index().search('ghost')
+    yield 'analytics', lambda: state['parser'].get_analytics('UTC')
+    yield 'analytics_tz', lambda: state['parser'].get_analytics('America/New_York')
+
+    def range_view():
+        months = state['parser'].get_song_months()['month']
+        middle = int(months.median()) if len(months) else 0
+        state['parser'].get_range_view(middle - 6, middle + 6)
+    yield 'range_view', range_view
+
+    cache_path = os.path.join(work_dir, 'cache-entry')
+    chunked_path = os.path.join(work_dir, 'chunked-entry')
+    yield 'chunked_aggregation', lambda: DataParser.from_zip_chunked(export_path, chunked_path, CHUNKED_MAX_BYTES)
+    yield 'write_cache', lambda: state['parser'].to_cache(cache_path)
+    yield 'read_cache', lambda: DataParser.from_cache(cache_path)
+
+    def append():
+        plays = state['plays']
+        half = len(plays) // 2
+        base = DataParser(plays.iloc[:half].reset_index(drop=True))
+        base.parse()
+        base.get_monthly_aggregation()
+        base.get_song_months()
+        state['append_args'] = (base, plays.iloc[half:].reset_index(drop=True))
+    yield 'append_prepare', append
+    yield 'append', lambda: state['append_args'][0].append(state['append_args'][1])
+
+    if include_upload:
+        yield 'upload_endpoint', lambda: upload(export_path, work_dir)
+
+
+def upload(export_path, work_dir):
+    """POST the export to /api/upload and wait for its background job to finish"""
+    app.app.config['UPLOAD_FOLDER'] = os.path.join(work_dir, 'uploads')
+    app.app.config['CACHE_FOLDER'] = os.path.join(work_dir, 'cache')
+    os.makedirs(app.app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.app.config['CACHE_FOLDER'], exist_ok=True)
+
+    client = app.app.test_client()
+    with open(export_path, 'rb') as export:
+        response = client.post('/api/upload', data={'file': (export, 'export.zip')})
+    job_id = response.get_json()['job']
+    while True:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['phase'] in ('done', 'failed'):
+            break
+        time.sleep(JOB_POLL_SECONDS)
+    if job['phase'] != 'done':
+        raise RuntimeError(f"Upload failed: {job.get('message')}")
+    response = client.get('/api/data/song?format=columns', headers={app.SESSION_HEADER: job['session']})
+    if response.status_code != 200:
+        raise RuntimeError(f'Fetching the uploaded data failed with {response.status_code}')
+
+
+def max_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure(export_path, include_upload, trace_memory):
+    """Run every stage once, returning seconds (or traced peak bytes) per stage"""
+    work_dir = tempfile.mkdtemp(prefix='spotify-bench-')
+    results = {}
+    try:
+        for name, stage in run_stages(export_path, work_dir, include_upload):
+            if trace_memory:
+                tracemalloc.start()
+                stage()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results[name] = {'peak_traced_bytes': peak}
+            else:
+                start = time.perf_counter()
+                stage()
+                results[name] = {'seconds': round(time.perf_counter() - start, 6), 'max_rss_bytes': max_rss_bytes()}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def benchmark_size(plays, args, data_dir):
+    export_path = os.path.join(data_dir, f'export-{plays}-{args.seed}.zip')
+    start = time.perf_counter()
+    export = generate_export(
+        export_path, plays, seed=args.seed, zipf=args.zipf, podcast_fraction=args.podcast_fraction
+    )
+    export['generate_seconds'] = round(time.perf_counter() - start, 3)
+    export['zip_bytes'] = os.path.getsize(export_path)
+    print(f"Generated {plays} plays in {export['generate_seconds']}s", file=sys.stderr)
+
+    stages = measure(export_path, not args.skip_upload, trace_memory=False)
+    if not args.no_memory:
+        for name, memory in measure(export_path, not args.skip_upload, trace_memory=True).items():
+            stages[name].update(memory)
+    for name, result in stages.items():
+        print(f"  {plays:>10} {name:<20} {result['seconds']:>9.3f}s", file=sys.stderr)
+
+    if not args.keep_exports:
+        os.remove(export_path)
+    return {'export': export, 'stages': stages}
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pyarrow': pa.__version__,
+        'parse_workers': app.app.config['PARSE_WORKERS'],
+    }
+
+
+def compare(baseline, current):
+    """Print the change in time and traced memory of every stage against a baseline run"""
+    previous = {run['export']['plays']: run['stages'] for run in baseline['runs']}
+    print(f"Compared with {baseline['environment'].get('commit')}:", file=sys.stderr)
+    for run in current['runs']:
+        plays = run['export']['plays']
+        if plays not in previous:
+            continue
+        for name, result in run['stages'].items():
+            before = previous[plays].get(name)
+            if not before:
+                continue
+            change = f"{plays:>10} {name:<20} {before['seconds']:>9.3f}s -> {result['seconds']:>9.3f}s"
+            if before['seconds'] > 0:
+                change += f" ({(result['seconds'] / before['seconds'] - 1) * 100:+.0f}%)"
+            if 'peak_traced_bytes' in before and 'peak_traced_bytes' in result:
+                change += f"  peak {before['peak_traced_bytes'] / 2 ** 20:.1f} -> {result['peak_traced_bytes'] / 2 ** 20:.1f} MiB"
+            print(change, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--plays', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help='export sizes to benchmark (10k to 10M plays)')
+    parser.add_argument('--output', help='file to write the JSON results to (default: stdout)')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--podcast-fraction', type=float, default=0.05)
+    parser.add_argument('--data-dir', default=tempfile.gettempdir(), help='where generated exports are written')
+    parser.add_argument('--keep-exports', action='store_true', help='keep generated exports in --data-dir')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--skip-upload', action='store_true', help='leave out the /api/upload stage')
+    args = parser.parse_args()
+
+    # Progress goes to stderr and the app logs there too, leaving stdout to the JSON
+    results = {
+        'environment': environment(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'runs': [benchmark_size(plays, args, args.data_dir) for plays in args.plays],
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
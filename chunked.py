@@ -0,0 +1,333 @@
+"""Aggregation of an export's plays within a memory ceiling, spilling chunks and partial totals to disk"""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from metrics import timed_stage
+from playstore import (
+    CATEGORICAL_PLAY_COLUMNS, NUMERIC_PLAY_COLUMNS, PlayFrameBuilder, aggregate_songs, fold_partials, month_partials,
+)
+
+# Chunked aggregation: estimated bytes a buffered play takes before its chunk is
+# built (measured at about 800) and a distinct name takes with its codes (about
+# 220), the fewest plays a chunk is given, and the number of hash buckets spilled
+# song partials are merged by
+CHUNKED_BYTES_PER_PLAY = 1024
+CHUNKED_BYTES_PER_NAME = 256
+CHUNKED_MIN_CHUNK_ROWS = 1000
+CHUNKED_SONG_BUCKETS = 1024
+
+class PartialRuns:
+    """Partial aggregates with integer key columns, folded in memory up to `max_bytes`
+    and spilled to disk in runs beyond that, sorted by `bucket` so they can be merged
+    a range of buckets at a time"""
+    def __init__(self, path, keys, sums, firsts, bucket, max_bytes):
+        self.path = path
+        self.keys = keys
+        self.sums = sums
+        self.firsts = firsts
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self.partial = None
+        # (path, distinct buckets, rows per bucket) of every spilled run
+        self.runs = []
+
+    def fold(self, partials):
+        return fold_partials(partials, self.keys, self.sums, self.firsts)
+
+    def add(self, partial):
+        self.partial = partial if self.partial is None else self.fold([self.partial, partial])
+        if int(self.partial.memory_usage().sum()) > self.max_bytes:
+            self.spill()
+
+    def spill(self):
+        buckets = self.bucket(self.partial)
+        order = np.argsort(buckets, kind='stable')
+        run = self.partial.iloc[order].assign(_bucket=buckets[order])
+        path = f"{self.path}-{len(self.runs):06d}.feather"
+        # One batch, so the bucket column maps back in without a copy
+        feather.write_feather(run, path, compression='uncompressed', chunksize=len(run))
+        self.runs.append((path, *np.unique(buckets, return_counts=True)))
+        self.partial = None
+
+    def merged(self):
+        """Yield the merged partials a range of buckets at a time, in bucket order"""
+        if not self.runs:
+            if self.partial is not None:
+                yield self.partial
+            return
+        if self.partial is not None and len(self.partial):
+            self.spill()
+
+        buckets, groups = np.unique(np.concatenate([values for _, values, _ in self.runs]), return_inverse=True)
+        rows = np.bincount(groups, weights=np.concatenate([counts for _, _, counts in self.runs]))
+        with pa.memory_map(self.runs[0][0]) as source:
+            schema = pa.ipc.open_file(source).schema
+        # Folding holds a few copies of the rows it merges
+        row_bytes = sum(field.type.bit_width // 8 for field in schema)
+        max_rows = max(1, self.max_bytes // (4 * row_bytes))
+
+        bounds = [0]
+        total = 0
+        for index, count in enumerate(rows):
+            if total and total + count > max_rows:
+                bounds.append(index)
+                total = 0
+            total += count
+        bounds.append(len(buckets))
+
+        for start, end in zip(bounds, bounds[1:]):
+            slices = []
+            for path, _, _ in self.runs:
+                # Mapped for one range at a time, so the pages read do not stay resident
+                with pa.memory_map(path) as source:
+                    run = pa.ipc.open_file(source).get_batch(0)
+                    run_buckets = run.column('_bucket').to_numpy()
+                    first = np.searchsorted(run_buckets, buckets[start], side='left')
+                    last = np.searchsorted(run_buckets, buckets[end - 1], side='right')
+                    if last > first:
+                        slices.append(run.slice(first, last - first).to_pandas(use_threads=False).drop(columns='_bucket'))
+                    del run, run_buckets
+            yield self.fold(slices)
+
+def coded_partials(partials, chunk_index):
+    """Song or month partials of a chunk with their names as integer codes, numbered
+    in a `first` column so the first play of a key can be told across chunks"""
+    coded = pd.DataFrame({
+        column: values.cat.codes.to_numpy().astype(np.int32) if isinstance(values.dtype, pd.CategoricalDtype) else values.to_numpy()
+        for column, values in partials.items()
+    })
+    coded['first'] = (chunk_index << 32) + np.arange(len(coded), dtype=np.int64)
+    return coded
+
+class ChunkedAggregator(PlayFrameBuilder):
+    """Aggregate plays within a memory ceiling of about `max_bytes`, spilling to `spill_path`"""
+    def __init__(self, spill_path, max_bytes):
+        self.spill_path = spill_path
+        self.max_bytes = max_bytes
+        # Code of every name per categorical column, in order of first appearance
+        self.names = {column: {} for column in CATEGORICAL_PLAY_COLUMNS}
+        super().__init__(chunk_size=self.chunk_rows())
+        self.chunk_paths = []
+        # Chunks from new_from on are new plays, dropped where an earlier chunk has
+        # the same (ts, track_uri) (see start_new_plays)
+        self.new_from = None
+        self.new_min_ts = None
+        self.known_keys = []
+        self.offered_plays = 0
+        self.new_plays = 0
+        os.makedirs(spill_path, exist_ok=True)
+
+    def free_bytes(self):
+        """The part of the ceiling the names seen so far leave over, at least an eighth"""
+        name_count = sum(len(codes) for codes in self.names.values())
+        return max(self.max_bytes - name_count * CHUNKED_BYTES_PER_NAME, self.max_bytes // 8)
+
+    def chunk_rows(self):
+        """Plays per chunk, buffering them within a quarter of the free part of the ceiling"""
+        return max(CHUNKED_MIN_CHUNK_ROWS, self.free_bytes() // 4 // CHUNKED_BYTES_PER_PLAY)
+
+    def encode(self, column, names):
+        """Codes of names in a categorical column, numbering unseen ones, with a
+        trailing -1 for missing values (code -1) to pick"""
+        codes = self.names[column]
+        encoded = np.fromiter((codes.setdefault(name, len(codes)) for name in names), dtype=np.int32, count=len(names))
+        return np.append(encoded, np.int32(-1))
+
+    def add_chunk(self, chunk):
+        self.spill_chunk({
+            **{column: self.encode(column, chunk[column].cat.categories)[chunk[column].cat.codes.to_numpy()]
+               for column in CATEGORICAL_PLAY_COLUMNS},
+            **{column: chunk[column].to_numpy() for column in NUMERIC_PLAY_COLUMNS},
+        })
+
+    def add_frame(self, play_frame):
+        """Add the plays of a play store"""
+        self.flush()
+        for start in range(0, len(play_frame), self.chunk_size):
+            self.add_chunk(play_frame.iloc[start:start + self.chunk_size])
+
+    def add_plays_file(self, plays_path):
+        """Add the plays of a cached play store, one batch at a time"""
+        self.flush()
+        reader = pa.ipc.open_file(pa.memory_map(plays_path))
+        # Batches of one file share their dictionaries, so each is only encoded once
+        dictionaries = {}
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            for start in range(0, batch.num_rows, self.chunk_size):
+                rows = batch.slice(start, self.chunk_size)
+                columns = {}
+                for column in CATEGORICAL_PLAY_COLUMNS:
+                    array = rows.column(column)
+                    known = dictionaries.get(column)
+                    if known is None or not known[0].equals(array.dictionary):
+                        known = dictionaries[column] = (array.dictionary, self.encode(column, array.dictionary.to_pylist()))
+                    columns[column] = known[1][pc.fill_null(array.indices, -1).to_numpy()]
+                for column in NUMERIC_PLAY_COLUMNS:
+                    columns[column] = rows.column(column).to_numpy()
+                self.spill_chunk(columns)
+
+    def start_new_plays(self):
+        """Mark the plays added from here on as new, to be dropped where the plays
+        added before already hold them (matched on ts and track URI, as in DataParser.append)"""
+        self.flush()
+        self.new_from = len(self.chunk_paths)
+
+    def spill_chunk(self, columns):
+        with timed_stage('chunk_spill'):
+            if self.new_from is not None and len(columns['ts']):
+                chunk_min_ts = int(columns['ts'].min())
+                self.new_min_ts = chunk_min_ts if self.new_min_ts is None else min(self.new_min_ts, chunk_min_ts)
+            path = os.path.join(self.spill_path, f"plays-{len(self.chunk_paths):06d}.feather")
+            feather.write_feather(pd.DataFrame(columns), path, compression='uncompressed')
+            self.chunk_paths.append(path)
+        self.chunk_size = self.chunk_rows()
+
+    def drop_known_plays(self, index, columns):
+        """Drop the new plays of a chunk that earlier plays already hold, collecting the
+        (ts, track URI) keys of earlier plays to match them against"""
+        ts, uris = columns['ts'], columns['track_uri']
+        if index < self.new_from:
+            # Only plays from when the new ones start can be repeated
+            if self.new_min_ts is not None:
+                recent = ts >= self.new_min_ts
+                self.known_keys.append((ts[recent], uris[recent]))
+            return columns
+
+        if not isinstance(self.known_keys, pd.MultiIndex):
+            self.known_keys = pd.MultiIndex.from_arrays([
+                np.concatenate([np.array([], dtype=np.int64), *(ts for ts, _ in self.known_keys)]),
+                np.concatenate([np.array([], dtype=np.int32), *(uris for _, uris in self.known_keys)]),
+            ])
+        keep = ~pd.MultiIndex.from_arrays([ts, uris]).isin(self.known_keys)
+        self.offered_plays += len(keep)
+        self.new_plays += int(keep.sum())
+        return {column: values[keep] for column, values in columns.items()}
+
+    def sorted_names(self):
+        """Sort every column's names like the dictionaries concat_play_frames merges,
+        returning the sorted names and the sorted position of every code (plus -1)"""
+        names, positions = {}, {}
+        for column, codes in self.names.items():
+            values = np.array(list(codes), dtype=object)
+            order = values.argsort(kind='stable')
+            names[column] = pd.Index(values[order], dtype=object)
+            positions[column] = np.append(np.argsort(order).astype(np.int32), np.int32(-1))
+        self.names = None
+        return names, positions
+
+    def finish(self):
+        """Write the play store, monthly and song months tables to `spill_path`
+
+        Returns their paths by cache file name along with the song totals in the shape
+        of aggregate_songs output, or None when no plays were added.
+        """
+        self.flush()
+        if not self.chunk_paths:
+            return None
+
+        # Folding holds a few times the running partials (see PartialRuns)
+        partial_bytes = self.free_bytes() // 16
+        names, positions = self.sorted_names()
+        dtypes = {column: pd.CategoricalDtype(values) for column, values in names.items()}
+        dictionaries = {column: pa.array(values, type=pa.string()) for column, values in names.items()}
+        songs = PartialRuns(
+            os.path.join(self.spill_path, 'songs'), ['track', 'artist'], ['total_ms_played', 'play_count'], ['album'],
+            lambda df: (df['track'].to_numpy(dtype=np.int64) * 7919 + df['artist'].to_numpy()) % CHUNKED_SONG_BUCKETS,
+            partial_bytes,
+        )
+        months = PartialRuns(
+            os.path.join(self.spill_path, 'months'), ['month', 'track', 'artist'], ['plays', 'ms_played', 'song_plays'], ['album'],
+            lambda df: df['month'].to_numpy(), partial_bytes,
+        )
+        paths = {name: os.path.join(self.spill_path, f"{name}.feather") for name in ['plays', 'monthly', 'song_months']}
+
+        with timed_stage('chunk_fold'):
+            writer = None
+            for index, path in enumerate(self.chunk_paths):
+                columns = {column: values.to_numpy() for column, values in feather.read_feather(path, use_threads=False).items()}
+                os.remove(path)
+                for column in CATEGORICAL_PLAY_COLUMNS:
+                    columns[column] = positions[column][columns[column]]
+                if self.new_from is not None:
+                    columns = self.drop_known_plays(index, columns)
+
+                batch = pa.RecordBatch.from_pydict({
+                    **{column: pa.DictionaryArray.from_arrays(pa.array(columns[column], mask=columns[column] < 0), dictionaries[column])
+                       for column in CATEGORICAL_PLAY_COLUMNS},
+                    **{column: pa.array(columns[column]) for column in NUMERIC_PLAY_COLUMNS},
+                })
+                if writer is None:
+                    writer = pa.ipc.new_file(paths['plays'], batch.schema)
+                writer.write_batch(batch)
+
+                chunk = pd.DataFrame({
+                    **{column: pd.Categorical.from_codes(columns[column], dtype=dtypes[column]) for column in CATEGORICAL_PLAY_COLUMNS},
+                    **{column: columns[column] for column in NUMERIC_PLAY_COLUMNS},
+                })
+                songs.add(coded_partials(aggregate_songs(chunk).rename(columns={'album_name': 'album'}), index))
+                months.add(coded_partials(month_partials(chunk), index))
+            writer.close()
+
+        with timed_stage('chunk_merge'):
+            # Songs in order of first play; the song table is as large as this anyway
+            song_totals = pd.concat(list(songs.merged()), ignore_index=True).sort_values('first', kind='stable')
+            song_totals = pd.DataFrame({
+                'track': pd.Categorical.from_codes(song_totals['track'].to_numpy(), dtype=dtypes['track']),
+                'artist': pd.Categorical.from_codes(song_totals['artist'].to_numpy(), dtype=dtypes['artist']),
+                'total_ms_played': song_totals['total_ms_played'].to_numpy(),
+                'play_count': song_totals['play_count'].to_numpy(),
+                'album_name': pd.Categorical.from_codes(song_totals['album'].to_numpy(), dtype=dtypes['album']),
+            })
+            artist_count = len(names['artist'])
+            song_keys = pd.Index(
+                song_totals['track'].cat.codes.to_numpy().astype(np.int64) * artist_count
+                + song_totals['artist'].cat.codes.to_numpy()
+            )
+            self.write_months(months, paths, dictionaries, song_keys, artist_count)
+        return paths, song_totals
+
+    def write_months(self, months, paths, dictionaries, song_keys, artist_count):
+        """Stream the merged month partials into the monthly and song months tables, month by month"""
+        monthly_schema = pa.schema([
+            ('month', pa.int64()), ('track', pa.dictionary(pa.int32(), pa.string())), ('artist', pa.string()),
+            ('plays', pa.int64()), ('ms_played', pa.int32()), ('album', pa.string()),
+        ])
+        song_months_schema = pa.schema([
+            ('month', pa.int32()), ('song', pa.int32()), ('plays', pa.int64()), ('ms_played', pa.int64()),
+        ])
+
+        def names(column, codes):
+            # Songs without artist or album metadata are reported with empty names, as in finish_months
+            return pc.fill_null(dictionaries[column].take(pa.array(codes, mask=codes < 0)), '')
+
+        monthly = pa.ipc.new_file(paths['monthly'], monthly_schema)
+        song_months = pa.ipc.new_file(paths['song_months'], song_months_schema)
+        with monthly, song_months:
+            for partial in months.merged():
+                # Each month in order of first play, like the monthly table aggregate_months builds
+                partial = partial.sort_values(['month', 'first'], kind='stable')
+                tracks = partial['track'].to_numpy()
+                artists = partial['artist'].to_numpy()
+                monthly.write_batch(pa.RecordBatch.from_arrays([
+                    pa.array(partial['month'].to_numpy()),
+                    pa.DictionaryArray.from_arrays(pa.array(tracks), dictionaries['track']),
+                    names('artist', artists),
+                    pa.array(partial['plays'].to_numpy()),
+                    pa.array(partial['ms_played'].to_numpy()),
+                    names('album', partial['album'].to_numpy()),
+                ], schema=monthly_schema))
+
+                is_song = artists >= 0
+                cube = pd.DataFrame({
+                    'month': partial['month'].to_numpy()[is_song].astype(np.int32),
+                    'song': song_keys.get_indexer(tracks[is_song].astype(np.int64) * artist_count + artists[is_song]).astype(np.int32),
+                    'plays': partial['song_plays'].to_numpy()[is_song],
+                    'ms_played': partial['ms_played'].to_numpy()[is_song].astype(np.int64),
+                }).sort_values(['month', 'song'])
+                song_months.write_batch(pa.RecordBatch.from_pandas(cube, schema=song_months_schema, preserve_index=False))
@@ -9,7 +9,7 @@ import { AggregationSelector, AggregationLevel } from "@/components/ui/aggregati
 import { SearchBar } from "@/components/ui/search-bar";
 import { DetailModal } from "@/components/ui/detail-modal";
 import { Instructions } from "@/components/ui/instructions";
-import { API_BASE_URL } from "@/lib/api-config";
+import { apiFetch, setSessionToken, tableRows } from "@/lib/api-config";
 import { MonthlyTopSongs } from "@/components/ui/monthly-top-songs";
 
 // Define the type for data items
@@ -32,6 +32,8 @@ export default function FileUploader() {
   const [albumData, setAlbumData] = useState<DataItem[]>([]);
   const [artistData, setArtistData] = useState<DataItem[]>([]);
   const [error, setError] = useState<string | null>(null);
+  const [uploadProgress, setUploadProgress] = useState<string | null>(null);
+  const [appendUpload, setAppendUpload] = useState<boolean>(false);
   const [aggregationLevel, setAggregationLevel] = useState<AggregationLevel>("song");
   const [activeTab, setActiveTab] = useState<string>("instructions");
   const [sortColumn, setSortColumn] = useState<string | null>("Plays");
@@ -170,10 +172,14 @@ export default function FileUploader() {
     
     const formData = new FormData();
     formData.append("file", acceptedFiles[0]);
+    if (appendUpload && isDataLoaded) {
+      // Merge a newer export into the data that is already loaded
+      formData.append("append", "true");
+    }
 
     try {
-      // Upload and process data at all levels at once
-      const response = await fetch(`${API_BASE_URL}/upload`, {
+      // Upload the file; the backend processes it in the background
+      const response = await apiFetch("/upload", {
         method: "POST",
         body: formData,
       });
@@ -184,10 +190,37 @@ export default function FileUploader() {
         throw new Error(result.message || "Upload failed");
       }
 
-      // Ensure we have arrays for each data type
-      const songDataArray = Array.isArray(result.data.song) ? result.data.song : [];
-      const albumDataArray = Array.isArray(result.data.album) ? result.data.album : [];
-      const artistDataArray = Array.isArray(result.data.artist) ? result.data.artist : [];
+      // Poll the job until processing has finished
+      let job = result;
+      do {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const jobResponse = await apiFetch(`/jobs/${result.job}`);
+        job = await jobResponse.json();
+        if (!jobResponse.ok) {
+          throw new Error(job.message || "Upload failed");
+        }
+        setUploadProgress(
+          job.files_total
+            ? `Parsed ${job.files_parsed} of ${job.files_total} files (${job.rows_processed.toLocaleString()} plays)...`
+            : `Processing (${job.phase})...`
+        );
+      } while (job.phase !== "done" && job.phase !== "failed");
+
+      if (job.phase === "failed") {
+        throw new Error(job.message || "Upload failed");
+      }
+
+      // Remember which backend session holds this dataset
+      setSessionToken(job.session);
+
+      // Fetch all three aggregation levels of the processed data
+      const [songDataArray, albumDataArray, artistDataArray] = await Promise.all(
+        ["song", "album", "artist"].map(async level => {
+          const dataResponse = await apiFetch(`/data/${level}?format=columns`);
+          const dataResult = await dataResponse.json();
+          return tableRows<DataItem>(dataResult.data);
+        })
+      );
 
       // Store data for all aggregation levels
       setSongData(songDataArray);
@@ -210,8 +243,9 @@ export default function FileUploader() {
       console.error("Error during file upload:", err);
     } finally {
       setLoading(false);
+      setUploadProgress(null);
     }
-  }, []);
+  }, [appendUpload, isDataLoaded]);
 
   // Function to change the aggregation level 
   const handleAggregationChange = useCallback((level: AggregationLevel) => {
@@ -230,22 +264,23 @@ export default function FileUploader() {
     if (currentData.length > 300) {
       setLoading(true);
       try {
-        const response = await fetch(
-          `${API_BASE_URL}/data/${aggregationLevel}/sort?column=${column}&direction=${newDirection}`
+        const response = await apiFetch(
+          `/data/${aggregationLevel}/sort?column=${column}&direction=${newDirection}&format=columns`
         );
         const result = await response.json();
         
-        if (response.ok && Array.isArray(result.data)) {
+        if (response.ok && result.data) {
+          const rows = tableRows<DataItem>(result.data);
           // Update the appropriate data set
           switch(aggregationLevel) {
             case "song":
-              setSongData(result.data);
+              setSongData(rows);
               break;
             case "album":
-              setAlbumData(result.data);
+              setAlbumData(rows);
               break;
             case "artist":
-              setArtistData(result.data);
+              setArtistData(rows);
               break;
           }
         }
@@ -264,13 +299,16 @@ export default function FileUploader() {
     
     try {
       // Call the demo data endpoint
-      const response = await fetch(`${API_BASE_URL}/demo-data`);
+      const response = await apiFetch("/demo-data");
       const result = await response.json();
 
       if (!response.ok) {
         throw new Error(result.message || "Failed to load demo data");
       }
 
+      // Remember which backend session holds this dataset
+      setSessionToken(result.session);
+
       // Ensure we have arrays for each data type
       const songDataArray = Array.isArray(result.data.song) ? result.data.song : [];
       const albumDataArray = Array.isArray(result.data.album) ? result.data.album : [];
@@ -378,6 +416,17 @@ export default function FileUploader() {
             <p className="text-spotify-off-white">Drag & drop a ZIP file, or click to select one</p>
           )}
         </div>
+
+        {isDataLoaded && (
+          <label className="flex items-center justify-center gap-2 mb-4 text-spotify-off-white text-sm">
+            <input
+              type="checkbox"
+              checked={appendUpload}
+              onChange={e => setAppendUpload(e.target.checked)}
+            />
+            Add this export to the data already loaded
+          </label>
+        )}
   
         <div className="text-center mt-4">
           <div className="flex items-center justify-center">
@@ -395,7 +444,7 @@ export default function FileUploader() {
           </button>
         </div>
   
-        {loading && <p className="text-center mt-4">Loading...</p>}
+        {loading && <p className="text-center mt-4">{uploadProgress || "Loading..."}</p>}
         {error && <p className="text-red-500 text-center mt-4">{error}</p>}
       </CardContent>
     </Card>
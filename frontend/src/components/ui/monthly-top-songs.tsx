@@ -1,7 +1,7 @@
 // src/components/ui/monthly-top-songs.tsx
 import { useState, useEffect } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
-import { API_BASE_URL } from "@/lib/api-config";
+import { apiFetch } from "@/lib/api-config";
 
 interface MonthlyTopSongsProps {
   isDataLoaded: boolean;
@@ -30,7 +30,7 @@ export const MonthlyTopSongs = ({ isDataLoaded }: MonthlyTopSongsProps) => {
     const fetchMonthlyTopSongs = async () => {
       try {
         setLoading(true);
-        const response = await fetch(`${API_BASE_URL}/monthly-top-songs`);
+        const response = await apiFetch("/monthly-top-songs");
         
         if (response.status === 404) {
           // This is the "No data available" response from the server
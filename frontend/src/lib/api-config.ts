@@ -23,4 +23,45 @@ function getApiBaseUrl(): string {
     return '/api';
   }
   
-  export const API_BASE_URL = getApiBaseUrl();
\ No newline at end of file
+  export const API_BASE_URL = getApiBaseUrl();
+
+  // Token of the dataset session handed out by /upload and /demo-data.
+  // The backend keeps one parsed dataset per session, so every data request
+  // has to say which one it wants.
+  let sessionToken: string | null = null;
+
+  export function setSessionToken(token: string | null) {
+    sessionToken = token;
+  }
+
+  export function apiFetch(path: string, init: RequestInit = {}): Promise<Response> {
+    const headers = new Headers(init.headers);
+    if (sessionToken) {
+      headers.set("X-Session-Token", sessionToken);
+    }
+    return fetch(`${API_BASE_URL}${path}`, { ...init, headers });
+  }
+
+  // Tables requested with format=columns come back as the column names plus one
+  // array of values per column, which is much smaller to send than one object
+  // per row. This turns them back into row objects.
+  export interface ColumnTable {
+    columns: string[];
+    data: unknown[][];
+  }
+
+  export function tableRows<T = Record<string, unknown>>(table: ColumnTable | null | undefined): T[] {
+    if (!table || !Array.isArray(table.columns) || !Array.isArray(table.data)) {
+      return [];
+    }
+    const rowCount = table.data.length > 0 ? table.data[0].length : 0;
+    const rows: T[] = new Array(rowCount);
+    for (let i = 0; i < rowCount; i++) {
+      const row: Record<string, unknown> = {};
+      table.columns.forEach((column, j) => {
+        row[column] = table.data[j][i];
+      });
+      rows[i] = row as T;
+    }
+    return rows;
+  }
@@ -0,0 +1,206 @@
+"""Stage and request timings, shared between worker processes and served in the Prometheus text format"""
+import json
+import os
+import resource
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context
+
+# Upper bounds of the duration histogram buckets served by /api/metrics, in seconds
+METRIC_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+# Worker processes publish their metrics for /api/metrics at most this often, and the
+# files of workers that have exited are dropped once this old
+METRICS_STATE_INTERVAL_SECONDS = 2
+METRICS_STATE_TTL_SECONDS = 24 * 60 * 60
+
+def current_rss_bytes():
+    """Resident memory of this process (its peak where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class DurationMetrics:
+    """Duration histograms, plus the largest memory growth seen, per key
+
+    Keys are tuples of label values. Series can be drained in one process and merged
+    into another, which is how worker processes report their parsing stages.
+    """
+    def __init__(self):
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds, memory_growth=0):
+        with self._lock:
+            entry = self.series.get(key)
+            if entry is None:
+                entry = self.series[key] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(METRIC_BUCKETS), 'memory_growth': 0}
+            entry['count'] += 1
+            entry['sum'] += seconds
+            for index, bound in enumerate(METRIC_BUCKETS):
+                if seconds <= bound:
+                    entry['buckets'][index] += 1
+            entry['memory_growth'] = max(entry['memory_growth'], memory_growth)
+
+    def merge(self, series):
+        with self._lock:
+            for key, other in series.items():
+                entry = self.series.setdefault(key, {'count': 0, 'sum': 0.0, 'buckets': [0] * len(METRIC_BUCKETS), 'memory_growth': 0})
+                entry['count'] += other['count']
+                entry['sum'] += other['sum']
+                entry['buckets'] = [a + b for a, b in zip(entry['buckets'], other['buckets'])]
+                entry['memory_growth'] = max(entry['memory_growth'], other['memory_growth'])
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {**entry, 'buckets': list(entry['buckets'])} for key, entry in self.series.items()}
+
+    def drain(self):
+        with self._lock:
+            series, self.series = self.series, {}
+        return series
+
+# Time and memory growth of each processing stage, keyed by (stage,)
+stage_metrics = DurationMetrics()
+# Time spent serving each route, keyed by (endpoint, method, status)
+request_metrics = DurationMetrics()
+
+def reset_stage_metrics():
+    """Start a worker process with empty metrics rather than a copy of its parent's"""
+    stage_metrics.drain()
+
+def record_stage(stage, seconds, memory_growth=0):
+    """Record time spent in a stage for /api/metrics and the current request's Server-Timing"""
+    stage_metrics.observe((stage,), seconds, memory_growth)
+    if has_request_context():
+        timings = g.setdefault('stage_timings', {})
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed_stage(stage):
+    start = time.perf_counter()
+    memory_before = current_rss_bytes()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, current_rss_bytes() - memory_before)
+
+def instrumented(stage):
+    """Decorate a function so that every call is recorded as a processing stage"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class MetricsPublisher:
+    """Shares this process's metrics, and the gauges `gauges()` returns, through `save(name, state)`"""
+    def __init__(self, save, gauges):
+        self.save = save
+        self.gauges = gauges
+        self._pid = None
+        self._name = None
+        self._saved_at = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def publish(self, force=False):
+        """Write this process's series and gauges, at most every METRICS_STATE_INTERVAL_SECONDS
+
+        Updates that come too soon are written once the interval is up, so the last
+        requests before a worker goes idle are not left out.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._pid != os.getpid():
+                # A new process, even if forked from one that already published
+                self._pid = os.getpid()
+                self._name = f"{self._pid}-{secrets.token_hex(4)}"
+                self._timer = None
+                force = True
+            if not force and now - self._saved_at < METRICS_STATE_INTERVAL_SECONDS:
+                if self._timer is None:
+                    self._timer = threading.Timer(self._saved_at + METRICS_STATE_INTERVAL_SECONDS - now, self.publish)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            self._saved_at = now
+            self._timer = None
+            name = self._name
+
+        self.save(name, {
+            'pid': os.getpid(),
+            'stages': [[list(key), entry] for key, entry in stage_metrics.snapshot().items()],
+            'requests': [[list(key), entry] for key, entry in request_metrics.snapshot().items()],
+            'gauges': {**self.gauges(), 'resident_memory_bytes': current_rss_bytes()},
+        })
+
+def collect_metrics(folder):
+    """Merge the metrics every worker process published to folder
+
+    Returns (stage series, request series, gauges). Histograms include workers that
+    have exited, so they never go backwards; gauges add up the running ones.
+    """
+    stages, requests, gauges = DurationMetrics(), DurationMetrics(), {}
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        names = []
+    now = time.time()
+    for name in names:
+        path = os.path.join(folder, name)
+        # Published under pid-token; anything with a dot is still being written
+        if '.' in name:
+            continue
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = process_alive(state['pid'])
+        if not alive:
+            try:
+                if now - os.path.getmtime(path) > METRICS_STATE_TTL_SECONDS:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+        stages.merge({tuple(key): entry for key, entry in state['stages']})
+        requests.merge({tuple(key): entry for key, entry in state['requests']})
+        if alive:
+            for gauge, value in state['gauges'].items():
+                gauges[gauge] = gauges.get(gauge, 0) + value
+    return stages.snapshot(), requests.snapshot(), gauges
+
+def prometheus_labels(names, values):
+    """Format label pairs for the Prometheus text format, escaping their values"""
+    escaped = [str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values]
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+def prometheus_histogram(lines, name, help_text, label_names, series):
+    """Append a duration histogram in the Prometheus text format to lines"""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, entry in sorted(series.items()):
+        labels = prometheus_labels(label_names, key)
+        for bound, count in zip(METRIC_BUCKETS, entry['buckets']):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+        lines.append(f"{name}_sum{{{labels}}} {entry['sum']:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {entry['count']}")
@@ -0,0 +1,338 @@
+"""Columnar play store of an export and the song, album, artist and monthly aggregates built from it"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from metrics import instrumented, timed_stage
+
+PLAY_FRAME_CHUNK_SIZE = 100_000
+# Columns of the play store, mapped to the export fields they are read from
+PLAY_FIELDS = {
+    'track': 'master_metadata_track_name',
+    'artist': 'master_metadata_album_artist_name',
+    'album': 'master_metadata_album_album_name',
+    'track_uri': 'spotify_track_uri',
+    'platform': 'platform',
+    'reason_start': 'reason_start',
+    'reason_end': 'reason_end',
+}
+CATEGORICAL_PLAY_COLUMNS = ['file', *PLAY_FIELDS]
+# Yes/no export fields, stored as int8 with -1 where the export leaves them out
+FLAG_FIELDS = {
+    'skipped': 'skipped',
+    'shuffle': 'shuffle',
+}
+NUMERIC_PLAY_COLUMNS = ['ms_played', 'ts', *FLAG_FIELDS]
+# Plays without a usable timestamp share numpy's NaT representation
+MISSING_TS = np.iinfo(np.int64).min
+
+class PlayFrameBuilder:
+    """Accumulate raw play records into a compact columnar DataFrame, `chunk_size` plays at a time"""
+    def __init__(self, chunk_size=PLAY_FRAME_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self._reset_buffer()
+
+    def _reset_buffer(self):
+        self.buffer = {column: [] for column in [*CATEGORICAL_PLAY_COLUMNS, *NUMERIC_PLAY_COLUMNS]}
+        self.buffered_rows = 0
+
+    def add(self, file_name, play):
+        buffer = self.buffer
+        buffer['file'].append(file_name)
+        for column, field in PLAY_FIELDS.items():
+            buffer[column].append(play.get(field))
+        buffer['ms_played'].append(play.get('ms_played') or 0)
+        buffer['ts'].append(play.get('ts'))
+        for column, field in FLAG_FIELDS.items():
+            buffer[column].append(play.get(field))
+        self.buffered_rows += 1
+        if self.buffered_rows >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered_rows:
+            return
+        buffer = self.buffer
+        with timed_stage('play_frame_build'):
+            chunk = pd.DataFrame({column: pd.Categorical(buffer[column]) for column in CATEGORICAL_PLAY_COLUMNS})
+            chunk['ms_played'] = np.asarray(buffer['ms_played'], dtype=np.int32)
+            chunk['ts'] = parse_timestamps(buffer['ts'])
+            for column in FLAG_FIELDS:
+                chunk[column] = parse_flags(buffer[column])
+        self._reset_buffer()
+        self.add_chunk(chunk)
+
+    def add_chunk(self, chunk):
+        self.chunks.append(chunk)
+
+    def build(self):
+        self.flush()
+        play_frame = concat_play_frames(self.chunks)
+        self.chunks = []
+        return play_frame
+
+@instrumented('play_frame_concat')
+def concat_play_frames(frames):
+    """Concatenate play store chunks, merging their string dictionaries"""
+    if not frames:
+        return empty_play_frame()
+
+    # Merge the per-chunk dictionaries into one sorted dictionary per column, so
+    # category codes follow lexical order and sorting on them sorts the strings
+    play_frame = pd.DataFrame({
+        column: union_categoricals([frame[column] for frame in frames], sort_categories=True)
+        for column in CATEGORICAL_PLAY_COLUMNS
+    })
+    for column in NUMERIC_PLAY_COLUMNS:
+        play_frame[column] = np.concatenate([frame[column].to_numpy() for frame in frames])
+    return play_frame
+
+def parse_timestamps(values):
+    """Convert ISO-8601 export timestamps to int64 epoch seconds"""
+    timestamps = pd.to_datetime(pd.Series(values, dtype=object), utc=True, errors='coerce', format='ISO8601')
+    return timestamps.dt.tz_localize(None).to_numpy().astype('datetime64[s]').astype(np.int64)
+
+def parse_flags(values):
+    """Convert export booleans to int8: 1 for true, 0 for false and -1 where missing"""
+    return np.array([-1 if value is None else int(bool(value)) for value in values], dtype=np.int8)
+
+def empty_play_frame():
+    play_frame = pd.DataFrame({column: pd.Categorical([]) for column in CATEGORICAL_PLAY_COLUMNS})
+    play_frame['ms_played'] = np.array([], dtype=np.int32)
+    play_frame['ts'] = np.array([], dtype=np.int64)
+    for column in FLAG_FIELDS:
+        play_frame[column] = np.array([], dtype=np.int8)
+    return play_frame
+
+def build_play_frame(plays):
+    """Build the columnar play store from (file_name, play) records"""
+    builder = PlayFrameBuilder()
+    for file_name, play in plays:
+        builder.add(file_name, play)
+    return builder.build()
+
+def song_numbers(play_frame):
+    """Number the (track, artist) song of every play in order of first play
+
+    Returns each play's song number (-1 without track or artist) and every song's track and artist codes.
+    """
+    tracks = play_frame['track'].cat.codes.to_numpy().astype(np.int64)
+    artists = play_frame['artist'].cat.codes.to_numpy().astype(np.int64)
+    artist_count = len(play_frame['artist'].cat.categories)
+    is_song = (tracks >= 0) & (artists >= 0)
+    numbers = np.full(len(play_frame), -1, dtype=np.int64)
+    numbers[is_song], song_keys = pd.factorize(tracks[is_song] * artist_count + artists[is_song])
+    return numbers, song_keys // artist_count, song_keys % artist_count
+
+def first_codes(groups, codes, group_count):
+    """First non-missing code of every group, in row order (-1 for groups without one)"""
+    present = np.flatnonzero((codes >= 0) & (groups >= 0))
+    first_rows = np.full(group_count, len(codes), dtype=np.int64)
+    np.minimum.at(first_rows, groups[present], present)
+    found = first_rows < len(codes)
+    first = np.full(group_count, -1, dtype=np.int64)
+    first[found] = codes[first_rows[found]]
+    return first
+
+@instrumented('song_rollup')
+def aggregate_songs(play_frame):
+    """Song totals of a play store, one row per (track, artist) in order of first play
+
+    Columns are track, artist, the first album seen, play_count and total_ms_played.
+    """
+    numbers, tracks, artists = song_numbers(play_frame)
+    song_count = len(tracks)
+    is_song = numbers >= 0
+    songs = numbers[is_song]
+
+    def categorical(column, codes):
+        return pd.Categorical.from_codes(codes, dtype=play_frame[column].dtype)
+
+    has_uri = play_frame['track_uri'].cat.codes.to_numpy()[is_song] >= 0
+    albums = play_frame['album'].cat.codes.to_numpy().astype(np.int64)
+    return pd.DataFrame({
+        'track': categorical('track', tracks),
+        'artist': categorical('artist', artists),
+        'total_ms_played': np.bincount(songs, weights=play_frame['ms_played'].to_numpy()[is_song], minlength=song_count).astype(np.int64),
+        'play_count': np.bincount(songs[has_uri], minlength=song_count),
+        'album_name': categorical('album', first_codes(numbers, albums, song_count)),
+    })
+
+def song_table(songs):
+    """Turn aggregate_songs output into the song-level table served to the frontend
+
+    Returns the table along with each song's exact total of milliseconds played,
+    which the table itself only carries as rounded minutes.
+    """
+    if songs.empty:
+        return pd.DataFrame(), np.array([], dtype=np.int64)
+
+    # Convert milliseconds to minutes and round to nearest hundredths place
+    song_df = pd.DataFrame({
+        'Song': songs['track'],
+        'Artist': songs['artist'],
+        'Plays': songs['play_count'].to_numpy(dtype=np.int64),
+        'Album': songs['album_name'],
+        'Minutes Played': (songs['total_ms_played'] / 60000).round(2),
+    })
+    return song_df, songs['total_ms_played'].to_numpy(dtype=np.int64)
+
+@instrumented('album_artist_rollup')
+def rollup_song_table(song_df):
+    """Roll a song table up to its album and artist tables over integer codes
+
+    Returns (album_df, album_centiminutes, artist_df, artist_centiminutes), both ordered by plays.
+    """
+    albums = song_df['Album'].cat.codes.to_numpy().astype(np.int64)
+    artists = song_df['Artist'].cat.codes.to_numpy().astype(np.int64)
+    plays = song_df['Plays'].to_numpy(dtype=np.int64)
+    centiminutes = with_centiminutes(song_df)['Centiminutes'].to_numpy()
+    artist_count = len(song_df['Artist'].cat.categories)
+
+    def sums(groups, values, group_count):
+        return np.bincount(groups, weights=values, minlength=group_count).astype(np.int64)
+
+    # Albums, in (Album, Artist) code order; songs without an album belong to none
+    has_album = albums >= 0
+    album_keys, album_groups = np.unique(albums[has_album] * artist_count + artists[has_album], return_inverse=True)
+    album_df = pd.DataFrame({
+        'Album': pd.Categorical.from_codes(album_keys // artist_count, dtype=song_df['Album'].dtype),
+        'Artist': pd.Categorical.from_codes(album_keys % artist_count, dtype=song_df['Artist'].dtype),
+        'Plays': sums(album_groups, plays[has_album], len(album_keys)),
+        'Songs': np.bincount(album_groups, minlength=len(album_keys)),
+        'Minutes_Played': sums(album_groups, centiminutes[has_album], len(album_keys)),
+    })
+
+    # Artists, in Artist code order, with the distinct albums of each counted from the album pairs
+    artist_codes, artist_groups = np.unique(artists, return_inverse=True)
+    artist_df = pd.DataFrame({
+        'Artist': pd.Categorical.from_codes(artist_codes, dtype=song_df['Artist'].dtype),
+        'Plays': sums(artist_groups, plays, len(artist_codes)),
+        'Songs': np.bincount(artist_groups, minlength=len(artist_codes)),
+        'Albums': np.bincount(album_keys % artist_count, minlength=artist_count)[artist_codes],
+        'Minutes_Played': sums(artist_groups, centiminutes, len(artist_codes)),
+    })
+
+    tables = []
+    for df in [album_df, artist_df]:
+        # Round minutes to 1 decimal place and sort by plays descending
+        df.insert(len(df.columns), 'Minutes Played', (df['Minutes_Played'] / 100).round(1))
+        df = df.sort_values('Plays', ascending=False)
+        tables.extend([df, df.pop('Minutes_Played').to_numpy()])
+    return tuple(tables)
+
+@instrumented('monthly_aggregation')
+def aggregate_months(play_frame):
+    """Aggregate plays to one row per (month, song), in order of each row's first play"""
+    return finish_months(month_partials(play_frame))
+
+def month_partials(play_frame):
+    """Totals per (month, track, artist) in order of first play, names still categorical
+
+    Alongside the monthly table's plays, song_plays counts plays with a track URI
+    the way the song table does, so song months can be derived from these too.
+    """
+    plays = play_frame[(play_frame['ts'] != MISSING_TS) & play_frame['track'].notna()]
+    # Months are kept as integer offsets from 1970-01 for cheap grouping
+    return plays.assign(month=play_months(plays)).groupby(
+        ['month', 'track', 'artist'], observed=True, sort=False, dropna=False
+    ).agg(
+        plays=pd.NamedAgg(column='ms_played', aggfunc='size'),
+        ms_played=pd.NamedAgg(column='ms_played', aggfunc='sum'),
+        album=pd.NamedAgg(column='album', aggfunc='first'),
+        song_plays=pd.NamedAgg(column='track_uri', aggfunc='count'),
+    ).reset_index()
+
+def finish_months(partials):
+    """Turn month_partials output into the monthly table"""
+    monthly_df = partials.drop(columns='song_plays')
+    # Songs without artist or album metadata are reported with empty names
+    for column in ['artist', 'album']:
+        monthly_df[column] = monthly_df[column].astype(object).fillna('')
+    return monthly_df
+
+def play_months(play_frame):
+    """Month of each play as an integer offset from 1970-01"""
+    return play_frame['ts'].to_numpy().astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+
+@instrumented('song_months')
+def aggregate_song_months(play_frame, song_keys):
+    """Partial song totals per (month, row of the song table), for time-range queries
+
+    `song_keys` is the key_index of the song table on Song and Artist.
+    """
+    plays = play_frame[(play_frame['ts'] != MISSING_TS) & play_frame['track'].notna() & play_frame['artist'].notna()]
+    partials = plays.assign(month=play_months(plays)).groupby(['month', 'track', 'artist'], observed=True, sort=False).agg(
+        plays=pd.NamedAgg(column='track_uri', aggfunc='count'),
+        ms_played=pd.NamedAgg(column='ms_played', aggfunc='sum'),
+    ).reset_index()
+    return index_song_months(partials, song_keys)
+
+def index_song_months(partials, song_keys):
+    """Build the song months cube from (month, track, artist) plays and ms_played of songs"""
+    return combine_song_months([pd.DataFrame({
+        'month': partials['month'].to_numpy(dtype=np.int32),
+        'song': song_keys.get_indexer(key_index(partials, ['track', 'artist'])).astype(np.int32),
+        'plays': partials['plays'].to_numpy(dtype=np.int64),
+        'ms_played': partials['ms_played'].to_numpy(dtype=np.int64),
+    })])
+
+def combine_song_months(cubes):
+    """Merge (month, song) partials into one cube sorted by month, so ranges are slices"""
+    cube = pd.concat(cubes, ignore_index=True) if len(cubes) > 1 else cubes[0]
+    return cube.groupby(['month', 'song'], sort=True).sum().reset_index()
+
+def fold_partials(partials, keys, sums, firsts):
+    """Merge partial aggregates of consecutive runs of plays, matching rows on the integer `keys`
+
+    `sums` columns are added up, `firsts` take the first code that is not -1, others the first row's.
+    """
+    frame = pd.concat(partials, ignore_index=True) if len(partials) > 1 else partials[0]
+    # Number the key combinations in order of first appearance, one key at a time
+    groups = np.zeros(len(frame), dtype=np.int64)
+    group_count = 1
+    for column in keys:
+        codes, uniques = pd.factorize(frame[column].to_numpy())
+        groups, combinations = pd.factorize(groups * len(uniques) + codes)
+        group_count = len(combinations)
+    first_rows = np.full(group_count, len(groups), dtype=np.int64)
+    np.minimum.at(first_rows, groups, np.arange(len(groups)))
+
+    folded = frame.iloc[first_rows].reset_index(drop=True)
+    for column in sums:
+        values = frame[column].to_numpy()
+        folded[column] = np.bincount(groups, weights=values, minlength=group_count).astype(values.dtype)
+    for column in firsts:
+        values = frame[column].to_numpy()
+        folded[column] = first_codes(groups, values, group_count).astype(values.dtype)
+    return folded
+
+def with_centiminutes(song_df):
+    """Add song minutes as integer hundredths, so that summing them is exact
+
+    Album and artist totals then round the same way no matter in which order
+    (or in how many incremental steps) their songs were added up.
+    """
+    return song_df.assign(Centiminutes=np.rint(song_df['Minutes Played'].to_numpy() * 100).astype(np.int64))
+
+def key_index(df, columns):
+    """Index over the (string) key columns of an aggregate, for aligning rows by key"""
+    return pd.MultiIndex.from_arrays([df[column].to_numpy(dtype=object) for column in columns])
+
+def fold_positions(base_keys, delta_keys):
+    """Find where delta rows land in a base aggregate
+
+    Keys already in the base map to their row; unseen keys are numbered after the
+    base's last row, in the order they appear in the delta.
+    """
+    positions = base_keys.get_indexer(delta_keys)
+    is_new = positions < 0
+    positions[is_new] = len(base_keys) + np.arange(is_new.sum())
+    return positions, is_new
+
+def grow(values, count, fill=0):
+    """Extend an array by count entries of fill"""
+    values = np.asarray(values)
+    dtype = object if fill is None else values.dtype
+    return np.concatenate([values.astype(dtype), np.full(count, fill, dtype=dtype)])
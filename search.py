@@ -0,0 +1,159 @@
+"""Prefix and trigram name search over the song, album and artist tables of a dataset"""
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# Levels searched, the column holding each level's name, and the default number of results
+SEARCH_TYPES = ['song', 'album', 'artist']
+SEARCH_NAME_COLUMNS = {'song': 'Song', 'album': 'Album', 'artist': 'Artist'}
+SEARCH_RESULT_LIMIT = 10
+
+def fold_text(text):
+    """Normalize a name for searching: accents stripped, case folded, whitespace collapsed"""
+    decomposed = unicodedata.normalize('NFKD', text.replace('\x00', ' '))
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).casefold().split())
+
+def text_codes(folded_names):
+    """Code points of folded names laid end to end, each followed by a 0 separator
+
+    Returns the codes (padded with two more zeros, so every position starts a
+    trigram) and the entry each position belongs to.
+    """
+    text = '\x00'.join(folded_names) + '\x00\x00\x00'
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    lengths = np.fromiter((len(name) + 1 for name in folded_names), dtype=np.int64, count=len(folded_names))
+    entries = np.repeat(np.arange(len(folded_names), dtype=np.int32), lengths)
+    return codes, np.append(entries, np.full(2, -1, dtype=np.int32))
+
+def trigram_keys(codes):
+    """Pack each run of three code points into one int64 (code points fit in 21 bits)"""
+    return (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+
+class SearchIndex:
+    """Prefix and trigram index over the song, album and artist names of a dataset"""
+    def __init__(self, song_df, album_df, artist_df):
+        levels = [('song', song_df), ('album', album_df), ('artist', artist_df)]
+        self.types = np.concatenate([np.full(len(df), SEARCH_TYPES.index(level), dtype=np.int8) for level, df in levels])
+        self.names = np.concatenate([df[SEARCH_NAME_COLUMNS[level]].to_numpy(dtype=object) for level, df in levels])
+        self.artists = np.concatenate([
+            df['Artist'].to_numpy(dtype=object) if level != 'artist' else np.full(len(df), None, dtype=object)
+            for level, df in levels
+        ])
+        self.albums = np.concatenate([
+            df['Album'].to_numpy(dtype=object) if level == 'song' else np.full(len(df), None, dtype=object)
+            for level, df in levels
+        ])
+        self.plays = np.concatenate([df['Plays'].to_numpy(dtype=np.int64) for _, df in levels])
+        self.minutes = np.concatenate([df['Minutes Played'].to_numpy(dtype=np.float64) for _, df in levels])
+
+        # Names repeat across levels (self-titled albums, artists), so fold each once
+        folded_names = {}
+        self.folded = np.array(
+            [folded_names.setdefault(name, fold_text(name)) if isinstance(name, str) else '' for name in self.names],
+            dtype=object
+        )
+        self.lengths = np.fromiter((len(name) for name in self.folded), dtype=np.int64, count=len(self.folded))
+
+        codes, entries = text_codes(self.folded)
+        keys = trigram_keys(codes)
+        present = codes != 0
+        # Trigrams that lie inside a single name
+        inside = present[:-2] & present[1:-1] & present[2:]
+        self.trigrams, self.trigram_entries = self._postings(keys[inside], entries[:-2][inside])
+
+        # Word starts, with the characters after the end of the name zeroed
+        previous = np.concatenate([[0], codes[:-1]])
+        starts = np.flatnonzero(present & ((previous == 0) | (previous == ord(' '))))
+        second = codes[starts + 1]
+        third = np.where(second != 0, codes[starts + 2], 0)
+        word_keys = (codes[starts] << 42) | (second << 21) | third
+        self.word_keys, self.word_entries = self._postings(word_keys, entries[starts])
+        first_word = previous[starts] == 0
+        self.word_first = first_word[np.lexsort((entries[starts], word_keys))]
+
+        self.nbytes = sum(array.nbytes for array in [
+            self.types, self.names, self.artists, self.albums, self.plays, self.minutes, self.folded,
+            self.lengths, self.trigrams, self.trigram_entries, self.word_keys, self.word_entries, self.word_first,
+        ]) + int(self.lengths.sum()) + 50 * len(folded_names)
+
+    @staticmethod
+    def _postings(keys, entries):
+        """Sort (key, entry) pairs by key, then entry"""
+        order = np.lexsort((entries, keys))
+        return keys[order], entries[order]
+
+    def _trigram_candidates(self, query):
+        """Entries holding every trigram of the query (a superset of the substring matches)"""
+        candidates = None
+        for key in np.unique(trigram_keys(np.array([ord(char) for char in query], dtype=np.int64))):
+            first, last = np.searchsorted(self.trigrams, [key, key + 1])
+            entries = np.unique(self.trigram_entries[first:last])
+            candidates = entries if candidates is None else np.intersect1d(candidates, entries, assume_unique=True)
+            if not len(candidates):
+                break
+        return candidates
+
+    def _substring_matches(self, query):
+        """Entries containing a query of three or more characters, with their match tier"""
+        candidates = self._trigram_candidates(query)
+        entries, tiers = [], []
+        for entry in candidates.tolist():
+            name = self.folded[entry]
+            position = name.find(query)
+            if position < 0:
+                continue
+            if position == 0:
+                tier = 3 if len(name) == len(query) else 2
+            else:
+                tier = 1 if f' {query}' in f' {name}' else 0
+            entries.append(entry)
+            tiers.append(tier)
+        return np.array(entries, dtype=np.int64), np.array(tiers, dtype=np.int8)
+
+    def _prefix_matches(self, query):
+        """Entries with a word starting with a query of one or two characters, with their match tier"""
+        codes = [ord(char) for char in query] + [0] * (3 - len(query))
+        low = (codes[0] << 42) | (codes[1] << 21) | codes[2]
+        # Any code points may follow the query's characters
+        high = low + (1 << (21 * (3 - len(query))))
+        first, last = np.searchsorted(self.word_keys, [low, high])
+        entries = self.word_entries[first:last].astype(np.int64)
+        first_word = self.word_first[first:last]
+        tiers = np.where(first_word, np.where(self.lengths[entries] == len(query), 3, 2), 1).astype(np.int8)
+        # Keep each entry's best tier
+        order = np.lexsort((-tiers, entries))
+        entries, tiers = entries[order], tiers[order]
+        keep = np.ones(len(entries), dtype=bool)
+        keep[1:] = entries[1:] != entries[:-1]
+        return entries[keep], tiers[keep]
+
+    def search(self, query, types=None, limit=SEARCH_RESULT_LIMIT):
+        """Find names matching a query, best first
+
+        Returns the top `limit` matches as a table (Type, Name, Artist, Album, Plays,
+        Minutes Played) along with the total number of matches.
+        """
+        query = fold_text(query)
+        if not query:
+            entries, tiers = np.array([], dtype=np.int64), np.array([], dtype=np.int8)
+        elif len(query) < 3:
+            entries, tiers = self._prefix_matches(query)
+        else:
+            entries, tiers = self._substring_matches(query)
+
+        if types is not None:
+            wanted = np.isin(self.types[entries], [SEARCH_TYPES.index(level) for level in types])
+            entries, tiers = entries[wanted], tiers[wanted]
+
+        order = np.lexsort((-self.plays[entries], -tiers))[:limit]
+        top = entries[order]
+        results = pd.DataFrame({
+            'Type': np.array(SEARCH_TYPES, dtype=object)[self.types[top]],
+            'Name': self.names[top],
+            'Artist': self.artists[top],
+            'Album': self.albums[top],
+            'Plays': self.plays[top],
+            'Minutes Played': self.minutes[top],
+        })
+        return results, len(entries)
@@ -1,2 +1,14 @@
 #!/bin/bash
-python app.py
+# Serves the API and the built frontend. Production runs several gunicorn worker
+# processes that share parsed datasets through the cache folder; set FLASK_DEBUG=1
+# to run Flask's single-process development server instead.
+if [ "${FLASK_DEBUG:-0}" = "1" ]; then
+  exec python app.py
+fi
+
+exec gunicorn app:app \
+  --bind "0.0.0.0:${PORT:-5000}" \
+  --workers "${WEB_WORKERS:-$(nproc)}" \
+  --threads "${WEB_THREADS:-4}" \
+  --timeout "${WEB_TIMEOUT:-120}" \
+  --access-logfile -
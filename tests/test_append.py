@@ -0,0 +1,70 @@
+"""Appending an export to a dataset gives the tables of parsing everything at once
+
+Run from the repository root: python -m pytest tests
+"""
+import os
+import sys
+import zipfile
+
+import pandas as pd
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+
+from app import DataParser, load_play_frame_from_zip  # noqa: E402
+from generate_export import generate_export  # noqa: E402
+
+
+def assert_same(expected, actual, name, keys=None):
+    if keys:
+        # Ties in plays may come out in another order
+        assert actual['Plays'].is_monotonic_decreasing
+        expected, actual = expected.sort_values(keys), actual.sort_values(keys)
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True), obj=name)
+
+
+def split_export(path, folder, parts):
+    """Write the Streaming_History files of an export in time order to ZIPs of the given slices"""
+    with zipfile.ZipFile(path) as export:
+        names = sorted(export.namelist(), key=lambda name: int(name.rsplit('_', 1)[1].split('.')[0]))
+        paths = []
+        for i, part in enumerate(parts):
+            paths.append(str(folder / f'part{i}.zip'))
+            with zipfile.ZipFile(paths[-1], 'w') as part_export:
+                for name in names[part]:
+                    part_export.writestr(name, export.read(name))
+    return paths
+
+
+@pytest.fixture(scope='module')
+def export(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('exports')
+    path = str(folder / 'full.zip')
+    generate_export(path, 24_000, tracks=600, start='2023-01-01', end='2025-01-01', plays_per_file=4000)
+    return path, folder
+
+
+@pytest.mark.parametrize('parts', [
+    # The second part repeats the first's last file
+    [slice(0, 3), slice(2, None)],
+    # Three appends, the middle one entirely known already
+    [slice(0, 2), slice(2, 4), slice(1, 3), slice(3, None)],
+])
+def test_append_matches_parsing_everything(export, parts):
+    path, folder = export
+    first, *rest = split_export(path, folder, parts)
+    appended = DataParser.from_zip(first)
+    appended.parse()
+    for part in rest:
+        appended = appended.append(load_play_frame_from_zip(part))
+
+    full = DataParser.from_zip(path)
+    assert_same(full.parse(), appended.parse(), 'song')
+    assert_same(full.get_album_aggregation(), appended.get_album_aggregation(), 'album', ['Album', 'Artist'])
+    assert_same(full.get_artist_aggregation(), appended.get_artist_aggregation(), 'artist', ['Artist'])
+    assert_same(full.get_monthly_aggregation(), appended.get_monthly_aggregation(), 'monthly')
+    assert_same(full.get_song_months(), appended.get_song_months(), 'song_months')
+    assert full.get_monthly_top_songs() == appended.get_monthly_top_songs()
+    assert len(appended.data) == len(full.data)
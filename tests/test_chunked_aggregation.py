@@ -0,0 +1,143 @@
+"""Chunked aggregation (AGGREGATION_MAX_BYTES): the same tables as in memory, within the ceiling
+
+Run from the repository root: python -m pytest tests
+"""
+import json
+import os
+import subprocess
+import sys
+import zipfile
+
+import pandas as pd
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+
+import app  # noqa: E402
+from app import DataParser  # noqa: E402
+from generate_export import generate_export  # noqa: E402
+
+# Small enough that the plays are spilled in many chunks, and the partials in many runs
+TINY_MAX_BYTES = 64 * 1024
+# Peak memory test: an export whose in-memory aggregation takes several times the ceiling
+MEMORY_TEST_PLAYS = 200_000
+MEMORY_TEST_MAX_BYTES = 16 * 1024 * 1024
+
+MEASURE_PEAK = '''
+import json, os, sys
+sys.path.insert(0, os.getcwd())
+import app
+from app import DataParser
+from metrics import current_rss_bytes
+
+def peak_growth(run):
+    # Writing 5 to clear_refs resets the peak resident memory (VmHWM) to the current one
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    before = current_rss_bytes()
+    run()
+    with open('/proc/self/status') as f:
+        peak = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+    return peak - before
+
+warm_up, export, work_dir, max_bytes = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+DataParser.from_zip_chunked(warm_up, os.path.join(work_dir, 'warm-up'), max_bytes)
+chunked = peak_growth(lambda: DataParser.from_zip_chunked(export, os.path.join(work_dir, 'chunked'), max_bytes))
+in_memory = peak_growth(lambda: DataParser.from_zip(export).aggregate_frames())
+print(json.dumps({'chunked': chunked, 'in_memory': in_memory}))
+'''
+
+
+def assert_same(expected, actual, name, keys=None):
+    if keys:
+        # Ties in plays may come out in another order
+        expected, actual = expected.sort_values(keys), actual.sort_values(keys)
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True), obj=name)
+
+
+def assert_same_dataset(expected, actual, sorted_rollups=False):
+    assert_same(expected.parse(), actual.parse(), 'song')
+    assert_same(expected.get_album_aggregation(), actual.get_album_aggregation(), 'album',
+                ['Album', 'Artist'] if sorted_rollups else None)
+    assert_same(expected.get_artist_aggregation(), actual.get_artist_aggregation(), 'artist',
+                ['Artist'] if sorted_rollups else None)
+    assert_same(expected.get_monthly_aggregation(), actual.get_monthly_aggregation(), 'monthly')
+    assert_same(expected.get_song_months(), actual.get_song_months(), 'song_months')
+    assert_same(expected.data, actual.data, 'plays')
+    assert expected.get_monthly_top_songs() == actual.get_monthly_top_songs()
+
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    """A two-year export, and two parts of it whose files overlap by one"""
+    folder = tmp_path_factory.mktemp('exports')
+    full = str(folder / 'full.zip')
+    generate_export(full, 24_000, tracks=600, start='2023-01-01', end='2025-01-01', plays_per_file=4000)
+    with zipfile.ZipFile(full) as export:
+        names = sorted(export.namelist(), key=lambda name: int(name.rsplit('_', 1)[1].split('.')[0]))
+        for part, members in [('first.zip', names[:3]), ('second.zip', names[2:])]:
+            with zipfile.ZipFile(str(folder / part), 'w') as part_export:
+                for name in members:
+                    part_export.writestr(name, export.read(name))
+    return {name: str(folder / f'{name}.zip') for name in ['full', 'first', 'second']}
+
+
+@pytest.fixture
+def cache_folder(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'CACHE_FOLDER', str(tmp_path))
+    return str(tmp_path)
+
+
+def test_chunked_matches_in_memory(exports, cache_folder):
+    chunked = DataParser.from_zip_chunked(exports['full'], os.path.join(cache_folder, 'full'), TINY_MAX_BYTES)
+    assert_same_dataset(DataParser.from_zip(exports['full']), chunked)
+
+
+def test_chunked_is_read_back_lazily(exports, cache_folder):
+    cache_path = os.path.join(cache_folder, 'full')
+    DataParser.from_zip_chunked(exports['full'], cache_path, TINY_MAX_BYTES)
+    cached = DataParser.from_cache(cache_path)
+    assert cached._data is None and cached.monthly_data is None and cached.song_months is None
+    assert_same_dataset(DataParser.from_zip(exports['full']), cached)
+
+
+@pytest.mark.parametrize('stored', [True, False])
+def test_chunked_append_matches_in_memory_append(exports, cache_folder, stored):
+    base = DataParser.from_zip(exports['first'])
+    base.version = 'base'
+    if stored:
+        app.store_dataset(base)
+    in_memory = base.append(app.load_play_frame_from_zip(exports['second']))
+    chunked = DataParser.from_zip_chunked(
+        exports['second'], os.path.join(cache_folder, 'merged'), TINY_MAX_BYTES, base_parser=base
+    )
+    assert_same_dataset(in_memory, chunked, sorted_rollups=True)
+
+
+def test_chunked_append_without_new_plays_returns_base(exports, cache_folder):
+    base = DataParser.from_zip(exports['full'])
+    base.version = 'base'
+    app.store_dataset(base)
+    appended = DataParser.from_zip_chunked(
+        exports['first'], os.path.join(cache_folder, 'merged'), TINY_MAX_BYTES, base_parser=base
+    )
+    assert appended is base
+    assert not os.path.exists(os.path.join(cache_folder, 'merged'))
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'), reason='needs Linux to reset the peak resident memory')
+def test_chunked_peak_memory_within_ceiling(tmp_path):
+    warm_up, export = str(tmp_path / 'warm-up.zip'), str(tmp_path / 'export.zip')
+    generate_export(warm_up, 5_000, tracks=2000, start='2024-01-01', end='2025-01-01')
+    generate_export(export, MEMORY_TEST_PLAYS, tracks=2000, start='2024-01-01', end='2025-01-01')
+    # In a process of its own, whose peak resident memory is this test's alone
+    result = subprocess.run(
+        [sys.executable, '-c', MEASURE_PEAK, warm_up, export, str(tmp_path), str(MEMORY_TEST_MAX_BYTES)],
+        cwd=REPO_ROOT, env={**os.environ, 'AGGREGATION_MAX_BYTES': str(MEMORY_TEST_MAX_BYTES)},
+        capture_output=True, text=True, check=True,
+    )
+    growth = json.loads(result.stdout.splitlines()[-1])
+    assert growth['in_memory'] > 2 * MEMORY_TEST_MAX_BYTES
+    assert growth['chunked'] <= MEMORY_TEST_MAX_BYTES
@@ -0,0 +1,103 @@
+"""ETags, content codings and the precompressed bodies of the session data endpoints
+
+Run from the repository root: python -m pytest tests
+"""
+import gzip
+import json
+import os
+import sys
+
+import brotli
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+
+import app  # noqa: E402
+from app import DataParser  # noqa: E402
+from generate_export import generate_export  # noqa: E402
+
+
+def decode(response):
+    body = response.get_data()
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'br':
+        body = brotli.decompress(body)
+    return json.loads(body)
+
+
+@pytest.fixture(scope='module')
+def export(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('exports') / 'export.zip')
+    generate_export(path, 5_000, tracks=300, start='2024-01-01', end='2025-01-01')
+    return path
+
+
+@pytest.fixture
+def client(export):
+    """A test client and the headers of a session on a freshly parsed export
+
+    The session isn't stored, so the parser served is the one created here.
+    """
+    token = app.parser_registry.add(DataParser.from_zip(export), stored=False)
+    return app.app.test_client(), {app.SESSION_HEADER: token}
+
+
+def test_matching_if_none_match_gets_304(client):
+    client, headers = client
+    response = client.get('/api/data/song', headers={**headers, 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200 and response.headers['ETag']
+
+    revalidated = client.get('/api/data/song', headers={
+        **headers, 'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']
+    })
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+    assert revalidated.headers['ETag'] == response.headers['ETag']
+
+    changed = client.get('/api/data/song', headers={**headers, 'If-None-Match': '"something-else"'})
+    assert changed.status_code == 200
+
+
+def test_each_content_coding_gets_its_own_etag(client):
+    client, headers = client
+    responses = {
+        encoding: client.get('/api/data/song/sort', headers={**headers, 'Accept-Encoding': encoding})
+        for encoding in ['br', 'gzip', 'identity']
+    }
+    assert {encoding: response.headers.get('Content-Encoding') for encoding, response in responses.items()} == {
+        'br': 'br', 'gzip': 'gzip', 'identity': None
+    }
+    assert len({response.headers['ETag'] for response in responses.values()}) == 3
+    assert decode(responses['br']) == decode(responses['gzip']) == decode(responses['identity'])
+
+
+@pytest.mark.parametrize('encoding', ['br', 'gzip'])
+@pytest.mark.parametrize('path', ['/api/data/song', '/api/data/song/sort', '/api/data/song/sort?format=columns'])
+def test_cached_body_matches_a_fresh_one(client, encoding, path):
+    client, headers = client
+    parser = app.parser_registry.get(headers[app.SESSION_HEADER])
+    fresh = client.get(path, headers={**headers, 'Accept-Encoding': encoding})
+    assert len(parser.response_cache) == 1
+
+    cached = client.get(path, headers={**headers, 'Accept-Encoding': encoding})
+    assert cached.get_data() == fresh.get_data()
+    assert cached.headers['Content-Encoding'] == encoding
+    assert cached.headers['ETag'] == fresh.headers['ETag']
+    assert decode(cached) == decode(client.get(path, headers={**headers, 'Accept-Encoding': 'identity'}))
+
+
+def test_table_order_and_sorted_views_are_cached_apart(client):
+    client, headers = client
+    headers = {**headers, 'Accept-Encoding': 'gzip'}
+    parser = app.parser_registry.get(headers[app.SESSION_HEADER])
+    own_order = [row['Plays'] for row in decode(client.get('/api/data/song', headers=headers))['data']]
+    by_plays = [row['Plays'] for row in decode(client.get('/api/data/song/sort', headers=headers))['data']]
+
+    assert own_order == parser.parse()['Plays'].tolist()
+    assert by_plays == sorted(own_order, reverse=True)
+    assert by_plays != own_order
+    assert [row['Plays'] for row in decode(client.get('/api/data/song', headers=headers))['data']] == own_order
@@ -0,0 +1,51 @@
+"""start/end month ranges of the /api/data endpoints
+
+Run from the repository root: python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+
+import app  # noqa: E402
+from app import DataParser  # noqa: E402
+from generate_export import generate_export  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    export = str(tmp_path_factory.mktemp('exports') / 'export.zip')
+    generate_export(export, 5_000, tracks=300, start='2023-01-01', end='2025-01-01')
+    token = app.parser_registry.add(DataParser.from_zip(export), stored=False)
+
+    def get(query):
+        return app.app.test_client().get(f'/api/data/song?{query}', headers={app.SESSION_HEADER: token})
+    return get
+
+
+@pytest.mark.parametrize('query', [
+    'start=2023&end=2023',
+    'start=2023-01&end=2023-12',
+    'start=2023-01-01&end=2023-12-31',
+    'start=2023-01-01&end=2024-01-01',
+])
+def test_end_includes_a_named_year_or_month(client, query):
+    response = client(query)
+    assert response.status_code == 200
+    assert (response.json['start'], response.json['end']) == ('2023-01-01', '2024-01-01')
+    assert response.json['total'] == client('start=2023-01-01T00:00:00Z&end=2024-01-01T00:00:00Z').json['total'] > 0
+
+
+def test_single_month(client):
+    response = client('start=2024-06&end=2024-06')
+    assert (response.json['start'], response.json['end']) == ('2024-06-01', '2024-07-01')
+    assert response.json['total'] > 0
+
+
+@pytest.mark.parametrize('query', ['start=2024&end=2023', 'start=2024-06-01&end=2024-06-01', 'start=soon'])
+def test_empty_or_bad_ranges_are_refused(client, query):
+    assert client(query).status_code == 400
@@ -0,0 +1,128 @@
+"""Checks of uploaded ZIPs against the upload limits as they stream in, and at the end
+
+Run from the repository root: python -m pytest tests
+"""
+import hashlib
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import app  # noqa: E402
+from upload_receipt import UploadReceipt  # noqa: E402
+
+
+class Unseekable:
+    """Write-only stream, which makes zipfile put each entry's sizes after its data"""
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+
+def make_zip(entries, compression=zipfile.ZIP_DEFLATED, streamed=False):
+    """A ZIP of (name, contents) entries; streamed ones have their sizes after the data"""
+    stream = Unseekable() if streamed else io.BytesIO()
+    with zipfile.ZipFile(stream, 'w', compression) as zip_ref:
+        for name, contents in entries:
+            zip_ref.writestr(name, contents)
+    return (stream.buffer if streamed else stream).getvalue()
+
+
+def export_entries(count=3):
+    return [(f'Spotify Extended Streaming History/Streaming_History_Audio_{i}.json', b'[]' * 500)
+            for i in range(count)]
+
+
+def receive(folder, body, chunk_size=64 * 1024):
+    """Write body into a new UploadReceipt in chunk_size pieces"""
+    receipt = UploadReceipt(folder, app.app.config)
+    for offset in range(0, len(body), chunk_size):
+        receipt.write(body[offset:offset + chunk_size])
+    return receipt
+
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 30, 64 * 1024])
+def test_headers_are_followed_across_writes(upload_folder, chunk_size):
+    body = make_zip(export_entries())
+    receipt = receive(upload_folder, body, chunk_size)
+    assert receipt.limits.entries == 3
+    assert receipt.finish() == hashlib.sha256(body).hexdigest()
+    receipt.close()
+    assert os.listdir(upload_folder) == []
+
+
+def test_header_split_between_two_writes(upload_folder):
+    body = make_zip(export_entries(1))
+    receipt = UploadReceipt(upload_folder, app.app.config)
+    receipt.write(body[:10])
+    assert receipt.limits.entries == 0
+    receipt.write(body[10:])
+    assert receipt.limits.entries == 1
+    receipt.close()
+
+
+def test_non_zip_is_refused_from_its_first_bytes(upload_folder):
+    receipt = UploadReceipt(upload_folder, app.app.config)
+    with pytest.raises(BadRequest, match='Invalid ZIP file'):
+        receipt.write(b'{"not": "a zip"}' * 4)
+    receipt.close()
+
+
+def test_too_many_entries(upload_folder):
+    body = make_zip([(f'{i}.json', b'[]') for i in range(app.app.config['UPLOAD_MAX_ENTRIES'] + 1)])
+    with pytest.raises(BadRequest, match='more than 1000 entries'):
+        receive(upload_folder, body)
+
+
+def test_deflate_bomb(upload_folder):
+    body = make_zip([('bomb.json', b'\0' * (4 << 20))])
+    assert len(body) < 64 * 1024
+    with pytest.raises(BadRequest, match='compressed too far'):
+        receive(upload_folder, body)
+
+
+def test_too_large_uncompressed(upload_folder, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'UPLOAD_MAX_UNCOMPRESSED_BYTES', 1 << 20)
+    body = make_zip([('a.json', os.urandom(600 << 10)), ('b.json', os.urandom(600 << 10))], zipfile.ZIP_STORED)
+    with pytest.raises(BadRequest, match='unpacks to more than 1 MB'):
+        receive(upload_folder, body)
+
+
+def test_streamed_entries_are_checked_by_finish(upload_folder):
+    # Sizes that trail the data stop the header walk; the central directory still has them
+    body = make_zip([('bomb.json', b'\0' * (4 << 20))], streamed=True)
+    receipt = receive(upload_folder, body)
+    assert receipt.next_header is None
+    with pytest.raises(ValueError, match='compressed too far'):
+        receipt.finish()
+    receipt.close()
+
+
+@pytest.mark.parametrize('body, message', [
+    (b'PK-but-not-really' * 10, 'Invalid ZIP file'),
+    (make_zip([('bomb.json', b'\0' * (4 << 20))]), 'compressed too far'),
+])
+def test_upload_endpoint_refuses_with_400(upload_folder, body, message):
+    response = app.app.test_client().post(
+        '/api/upload', data={'file': (io.BytesIO(body), 'export.zip')}, content_type='multipart/form-data'
+    )
+    assert response.status_code == 400
+    assert message in response.json['message']
+    assert os.listdir(upload_folder) == []
@@ -0,0 +1,146 @@
+"""Receipt of uploaded exports: streamed to disk, hashed and checked against the upload limits on the way"""
+import hashlib
+import os
+import secrets
+import struct
+import zipfile
+
+from flask import Request, current_app
+from werkzeug.exceptions import BadRequest
+
+ALLOWED_EXTENSIONS = {'zip'}
+# Fixed part of a ZIP local file header (section 4.3.7 of the ZIP APPNOTE): signature,
+# versions, flags, method, time, date, CRC, compressed and uncompressed size, and the
+# lengths of the name and extra field that follow it
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+# An archive with no entries is just the end of central directory record
+ZIP_EMPTY_SIGNATURE = b'PK\x05\x06'
+# Flag of entries whose sizes follow their data in a data descriptor
+ZIP_DATA_DESCRIPTOR_FLAG = 0x08
+# Sizes stored as this are in a ZIP64 extra field instead
+ZIP64_SIZE = 0xFFFFFFFF
+# Entries inflating to less than this are never treated as zip bombs
+ZIP_RATIO_MIN_BYTES = 1 << 20
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+class ZipLimits:
+    """Running check of a ZIP's entries against the upload limits in `config`; add() raises ValueError on a breach"""
+    def __init__(self, config):
+        self.config = config
+        self.entries = 0
+        self.uncompressed_bytes = 0
+
+    def add(self, file_size, compress_size):
+        self.entries += 1
+        self.uncompressed_bytes += file_size
+        if self.entries > self.config['UPLOAD_MAX_ENTRIES']:
+            raise ValueError(f"ZIP file has more than {self.config['UPLOAD_MAX_ENTRIES']} entries")
+        if self.uncompressed_bytes > self.config['UPLOAD_MAX_UNCOMPRESSED_BYTES']:
+            raise ValueError(
+                f"ZIP file unpacks to more than {self.config['UPLOAD_MAX_UNCOMPRESSED_BYTES'] // 1024 ** 2} MB"
+            )
+        if file_size > ZIP_RATIO_MIN_BYTES and file_size > compress_size * self.config['UPLOAD_MAX_COMPRESSION_RATIO']:
+            raise ValueError('ZIP file has an entry that is compressed too far to be an export')
+
+class UploadReceipt:
+    """Writable file that receives an uploaded export, hashing it and checking its entries on the way"""
+    def __init__(self, folder, config):
+        self.config = config
+        self.path = os.path.join(folder, f"upload-{secrets.token_hex(8)}.part")
+        self.file = open(self.path, 'w+b')
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.limits = ZipLimits(config)
+        # Offset of the next local file header (None once headers can't be
+        # followed) and the part of it received so far
+        self.next_header = 0
+        self.header = b''
+        self.kept = False
+
+    def write(self, data):
+        start = self.size
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+        while self.next_header is not None:
+            position = self.next_header + len(self.header)
+            if position >= self.size:
+                break
+            needed = ZIP_LOCAL_HEADER.size - len(self.header)
+            self.header += data[position - start:position - start + needed]
+            if len(self.header) == ZIP_LOCAL_HEADER.size:
+                try:
+                    self.read_header()
+                except ValueError as e:
+                    # The form parser takes a ValueError for a malformed body and drops the file
+                    raise BadRequest(str(e)) from e
+        return len(data)
+
+    def read_header(self):
+        """Check the local file header in self.header and find where the next one starts"""
+        (signature, _, flags, _, _, _, _, compress_size, file_size,
+         name_length, extra_length) = ZIP_LOCAL_HEADER.unpack(self.header)
+        self.header = b''
+        if signature != ZIP_LOCAL_HEADER_SIGNATURE:
+            if self.next_header == 0 and signature != ZIP_EMPTY_SIGNATURE:
+                raise ValueError('Invalid ZIP file')
+            # Past the last entry: the central directory follows
+            self.next_header = None
+            return
+        if flags & ZIP_DATA_DESCRIPTOR_FLAG or ZIP64_SIZE in (compress_size, file_size):
+            self.next_header = None
+            return
+        self.limits.add(file_size, compress_size)
+        self.next_header += ZIP_LOCAL_HEADER.size + name_length + extra_length + compress_size
+
+    def finish(self):
+        """Check the entries listed in the central directory and return the upload's SHA-256
+
+        Raises zipfile.BadZipFile for a broken archive and ValueError for one beyond the limits.
+        """
+        self.file.flush()
+        limits = ZipLimits(self.config)
+        with zipfile.ZipFile(self.file) as zip_ref:
+            for member in zip_ref.infolist():
+                limits.add(member.file_size, member.compress_size)
+        return self.digest.hexdigest()
+
+    def keep(self, path):
+        """Move the upload to path, where it stays after the request"""
+        os.replace(self.path, path)
+        self.path = path
+        self.kept = True
+
+    def close(self):
+        self.file.close()
+        if not self.kept:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        # Reading back and seeking go straight to the file
+        return getattr(self.file, name)
+
+class UploadRequest(Request):
+    """Request that streams uploaded ZIPs into UploadReceipts instead of temporary files"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_receipts = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename is None or not allowed_file(filename):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        receipt = UploadReceipt(current_app.config['UPLOAD_FOLDER'], current_app.config)
+        # Closed along with the request, even when parsing the form fails partway
+        self.upload_receipts.append(receipt)
+        return receipt
+
+    def close(self):
+        super().close()
+        for receipt in self.upload_receipts:
+            receipt.close()